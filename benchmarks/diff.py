@@ -0,0 +1,121 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.diff import WordDiff  # noqa: E402
+
+SIZES = {"1KB": 1_000, "100KB": 100_000, "1MB": 1_000_000}
+SYLLABLES = ("pa", "da", "ar", "ri", "ved", "ear", "li", "er", "so", "ft", "cu", "te", "lo", "we", "si", "ze", "pai")
+
+
+def make_vocabulary(size=5000, seed=0):
+    """
+    Generates the words of the texts, with their Zipf frequencies, like the ones of English prose.
+
+    Args:
+        size (int): (Optional) The number of distinct words. Defaults to 5000.
+        seed (int): (Optional) The seed of the random generator. Defaults to 0.
+
+    Returns:
+        tuple[list[str], list[float]]: The words, and their cumulative weights.
+    """
+    rng = random.Random(seed)
+    words = {"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size * 2)}
+    words = sorted(words, key=len)[:size]
+    weights, total = [], 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1 / rank
+        weights.append(total)
+    return words, weights
+
+
+def make_texts(size, edit_rate=0.03, seed=0):
+    """
+    Generates a text of about `size` characters in paragraphs, and a proofread version of it with a fraction of its
+    words replaced, inserted or deleted.
+
+    Args:
+        size (int): The length of the source text in characters.
+        edit_rate (float): (Optional) The fraction of the words edited. Defaults to 0.03.
+        seed (int): (Optional) The seed of the random generator. Defaults to 0.
+
+    Returns:
+        tuple[str, str]: The source and the proofread texts.
+    """
+    rng = random.Random(seed)
+    words, weights = make_vocabulary(seed=seed)
+
+    def draw_word():
+        return rng.choices(words, cum_weights=weights)[0]
+
+    source, test, length = [], [], 0
+    while length < size:
+        word = draw_word()
+        if rng.random() < 0.06:
+            word += "."
+        if rng.random() < 0.01:
+            word += "\n\n"
+        source.append(word)
+        length += len(word) + 1
+        draw = rng.random()
+        if draw < edit_rate / 3:
+            test.append(draw_word().capitalize())
+        elif draw < edit_rate * 2 / 3:
+            test.extend([word, draw_word()])
+        elif draw >= edit_rate:
+            test.append(word)
+    return " ".join(source), " ".join(test)
+
+
+def measure(build):
+    """
+    Runs a diff and renders its Markdown, measuring its time and its peak memory.
+
+    Args:
+        build (Callable[[], Any]): Returns an object with an `output_markdown` attribute, like `Redlines`.
+
+    Returns:
+        tuple[float, int, str]: The seconds taken, the peak of the allocated bytes and the Markdown.
+    """
+    started_at = time.perf_counter()
+    output = build().output_markdown
+    elapsed = time.perf_counter() - started_at
+    tracemalloc.start()
+    build().output_markdown
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, output
+
+
+def print_row(name, engine, elapsed, peak, output):
+    marks = output.count("</span>")
+    print(f"{name:<8}{engine:<10}{elapsed * 1000:>9.1f} ms{peak / 2**20:>11.1f} MB{marks:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the word diff with Redlines on generated proofreading texts")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="comma separated input sizes among 1KB, 100KB, 1MB")
+    parser.add_argument("--edit-rate", type=float, default=0.03, help="fraction of the words edited")
+    parser.add_argument("--redlines-max-size", default="100KB", help="largest input compared with Redlines")
+    args = parser.parse_args()
+
+    from redlines import Redlines
+
+    # Redlines treats the frequent words of long texts as junk, so its marks can differ from the minimal ones
+    print(f"{'input':<8}{'engine':<10}{'time':>12}{'peak memory':>14}{'marks':>10}")
+    for name in args.sizes.split(","):
+        source, test = make_texts(SIZES[name], args.edit_rate)
+        print_row(name, "WordDiff", *measure(lambda: WordDiff(source, test)))
+        if SIZES[name] > SIZES[args.redlines_max_size]:
+            print(f"{name:<8}{'Redlines':<10}{'skipped':>12}")
+            continue
+        print_row(name, "Redlines", *measure(lambda: Redlines(source, test)))
+
+
+if __name__ == "__main__":
+    main()
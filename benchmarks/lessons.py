@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+from importlib import import_module
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.cache import set_cache  # noqa: E402
+from llm.mock_server import MockServer  # noqa: E402
+from llm.rate_limit import get_rate_limiter, set_rate_limiter  # noqa: E402
+from llm.registry import find_lessons  # noqa: E402
+from llm.resilience import get_hedger  # noqa: E402
+from llm.singleflight import get_single_flight  # noqa: E402
+from llm.tracing import disable_tracing, enable_tracing, span  # noqa: E402
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of a list of values.
+
+    Args:
+        values (list[float]): The values.
+        fraction (float): The percentile as a fraction, like 0.95.
+
+    Returns:
+        float | None: The percentile, or None when there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+@contextlib.contextmanager
+def record_latencies(latencies):
+    """
+    Records the latency of every ChatCompletion request made inside the context, from the client side.
+
+    Args:
+        latencies (list[float]): The list the latencies, in seconds, are appended to.
+    """
+    import openai
+
+    create, acreate = openai.ChatCompletion.create, openai.ChatCompletion.acreate
+
+    def timed_create(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return create(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started_at)
+
+    async def timed_acreate(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await acreate(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started_at)
+
+    openai.ChatCompletion.create, openai.ChatCompletion.acreate = timed_create, timed_acreate
+    try:
+        yield
+    finally:
+        openai.ChatCompletion.create, openai.ChatCompletion.acreate = create, acreate
+
+
+def summarize(wall_time, requests, latencies, error=None):
+    return {
+        "error": error,
+        "wall_time": wall_time,
+        "requests": requests,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+    }
+
+
+def run(
+    latency="lognormal:0.05,0.5",
+    error_rate=0.0,
+    use_cache=False,
+    seed=0,
+    requests_per_minute=None,
+    tokens_per_minute=None,
+):
+    """
+    Runs the `execute()` of every lesson against a local mock server.
+
+    Args:
+        latency (str): (Optional) The latency distribution of the mock server. Defaults to "lognormal:0.05,0.5".
+        error_rate (float): (Optional) The fraction of requests the mock server fails. Defaults to 0.
+        use_cache (bool): (Optional) Whether to keep the response cache enabled. Defaults to False.
+        seed (int): (Optional) The seed of the mock server draws. Defaults to 0.
+        requests_per_minute (int): (Optional) The requests limit the mock server enforces with 429 errors.
+            Defaults to None, no limit.
+        tokens_per_minute (int): (Optional) The tokens limit the mock server enforces with 429 errors. Defaults to
+            None, no limit.
+
+    Returns:
+        dict: The wall time, the request count and the latency percentiles of each lesson and of the whole run, the
+        hedging and single-flight counters, and the rate limits with the throughput the rate limiter reached under
+        them.
+    """
+    with MockServer(
+        latency=latency,
+        error_rate=error_rate,
+        seed=seed,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+    ) as server:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        import openai
+
+        openai.api_base = server.api_base
+        if not use_cache:
+            set_cache(None)
+        # A new rate limiter starts from its configured budgets, and learns the limits of the server from its headers
+        set_rate_limiter(None)
+
+        results = {}
+        all_latencies = []
+        started_at = time.perf_counter()
+        for lesson in find_lessons():
+            if not lesson["has_execute"]:
+                continue
+            module = import_module(f"classes.{lesson['module']}")
+            latencies = []
+            requests_before = server.requests
+            lesson_started_at = time.perf_counter()
+            error = None
+            try:
+                with record_latencies(latencies), contextlib.redirect_stdout(io.StringIO()):
+                    with span(lesson["name"], "lesson"):
+                        module.execute()
+            except Exception as exception:  # an injected error reaching the lesson fails only that lesson
+                error = f"{type(exception).__name__}: {str(exception)[:200]}"
+            results[lesson["module"]] = summarize(
+                time.perf_counter() - lesson_started_at, server.requests - requests_before, latencies, error
+            )
+            all_latencies.extend(latencies)
+
+        wall_time = time.perf_counter() - started_at
+        limiter = get_rate_limiter().stats()
+        return {
+            "python": platform.python_version(),
+            "latency": latency,
+            "lessons": results,
+            "total": summarize(wall_time, server.requests, all_latencies),
+            "hedging": get_hedger().stats(),
+            "single_flight": get_single_flight().stats(),
+            "rate_limits": {
+                "requests_per_minute": requests_per_minute,
+                "tokens_per_minute": tokens_per_minute,
+                "rate_limited": server.rate_limited,
+                "waited_seconds": limiter["waited_seconds"],
+                # The bucket of the limiter starts full, so a run shorter than a minute can go over the limits
+                "achieved_requests_per_minute": (server.requests - server.rate_limited) / wall_time * 60,
+                "achieved_tokens_per_minute": limiter["tokens"] / wall_time * 60,
+            },
+        }
+
+
+def _format(value, unit=""):
+    if value is None:
+        return "-"
+    return f"{value * 1000:.1f} ms" if unit == "ms" else str(value)
+
+
+def print_report(report, baseline=None):
+    """
+    Prints the benchmark results as a table, with the change of the wall time against a baseline when given.
+
+    Args:
+        report (dict): The results returned by `run`.
+        baseline (dict): (Optional) Previous results to compare with. Defaults to None.
+    """
+    rows = list(report["lessons"].items()) + [("total", report["total"])]
+    print(f"{'lesson':<24}{'wall':>12}{'requests':>10}{'p50':>12}{'p95':>12}{'p99':>12}{'vs baseline':>14}")
+    for name, result in rows:
+        change = ""
+        if baseline is not None:
+            previous = baseline["total"] if name == "total" else baseline["lessons"].get(name)
+            if previous and previous["wall_time"]:
+                change = f"{(result['wall_time'] / previous['wall_time'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:<24}{_format(result['wall_time'], 'ms'):>12}{result['requests']:>10}"
+            f"{_format(result['latency_p50'], 'ms'):>12}{_format(result['latency_p95'], 'ms'):>12}"
+            f"{_format(result['latency_p99'], 'ms'):>12}{change:>14}"
+        )
+        if result["error"]:
+            print(f"  failed: {result['error']}")
+    if "hedging" in report:
+        hedging = report["hedging"]
+        print(
+            f"hedged {hedging['hedges']} of {hedging['requests']} requests ({hedging['extra_load'] * 100:.1f}% extra "
+            f"load), {hedging['hedge_wins']} answered first"
+        )
+    if "single_flight" in report:
+        print(f"{report['single_flight']['saved']} identical concurrent requests shared a call in flight")
+    limits = report.get("rate_limits")
+    if limits and (limits["requests_per_minute"] or limits["tokens_per_minute"]):
+        parts = []
+        for unit, limit in (("requests", limits["requests_per_minute"]), ("tokens", limits["tokens_per_minute"])):
+            achieved = limits[f"achieved_{unit}_per_minute"]
+            parts.append(
+                f"{achieved:.0f} {unit}/min" + (f" ({achieved / limit * 100:.0f}% of {limit})" if limit else "")
+            )
+        print(
+            f"{', '.join(parts)}, {limits['rate_limited']} rate limit errors, {limits['waited_seconds']:.1f} s "
+            "spent by the requests waiting for the rate limiter"
+        )
+    if "spans" in report:
+        print(f"{'span':<40}{'count':>8}{'total':>12}")
+        for name, total in sorted(report["spans"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f"{name:<40}{total['count']:>8}{_format(total['seconds'], 'ms'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every lesson against the local mock server")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="mock server latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of failed mock requests")
+    parser.add_argument("--use-cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--rpm", type=int, help="requests per minute limit enforced by the mock server")
+    parser.add_argument("--tpm", type=int, help="tokens per minute limit enforced by the mock server")
+    parser.add_argument("--output", help="JSON file the results are written to, e.g. benchmarks/baseline.json")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--trace", metavar="PATH", help="Chrome trace JSON file the spans of the run are written to")
+    parser.add_argument("--profile", metavar="PATH", help="pstats file a cProfile profile of the run is written to")
+    args = parser.parse_args()
+
+    tracer = enable_tracing(profile=bool(args.profile)) if args.trace or args.profile else None
+    report = run(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        use_cache=args.use_cache,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+    )
+    if tracer is not None:
+        disable_tracing()
+        if args.trace:
+            tracer.write_chrome_trace(args.trace)
+        if args.profile:
+            tracer.write_pstats(args.profile)
+        report["spans"] = tracer.summary()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from llm.stream_parser import JsonParser, StreamDivergedError, parse_stream
+from llm.templates import PromptTemplate, normalize_whitespace
 from main import get_completion
 
 
@@ -9,7 +11,8 @@ def execute():
     # ** --------------------------------------------------
 
     # ** Tactic 1: Use delimiters to clearly indicate distinct parts of the input
-    text_1 = """
+    text_1 = normalize_whitespace(
+        """
     You should express what you want a model to do by \
     providing instructions that are as clear and \
     specific as you can possibly make them. \
@@ -21,25 +24,36 @@ def execute():
     and context for the model, which can lead to \
     more detailed and relevant outputs.
     """
-    prompt_1 = f"""
+    )
+    prompt_1 = PromptTemplate(
+        """
     Summarize the text delimited by triple backticks \
     into a single sentence.
     ```{text_1}```
     """
-    response_1 = get_completion(prompt_1)
+    )
+    response_1 = get_completion(prompt_1.render(text_1=text_1))
     print(response_1)
     # response
     # Clear and specific instructions should be provided to guide a model towards the desired output, and longer
     # prompts can provide more clarity and context for the model, leading to more detailed and relevant outputs.
 
     # ** Tactic 2: Ask for a structured output
-    prompt_2 = """
+    prompt_2 = PromptTemplate(
+        """
     Generate a list of three made-up book titles along \
     with their authors and genres.
     Provide them in JSON format with the following keys:
     book_id, title, author, genre.
     """
-    response_2 = get_completion(prompt_2)
+    )
+    # Each book is validated as soon as it is streamed, so a malformed answer is abandoned without waiting for the end
+    book_schema = {"book_id": int, "title": str, "author": str, "genre": str}
+    try:
+        response_2 = parse_stream(get_completion(prompt_2.render(), stream=True), JsonParser(book_schema, array=True))
+    except StreamDivergedError:
+        # The answer isn't the expected JSON, so it is shown as it is
+        response_2 = get_completion(prompt_2.render())
     print(response_2)
     # response
     # [
@@ -49,7 +63,8 @@ def execute():
     # ]
 
     # ** Tactic 3: Ask the model to check whether conditions are satisfied
-    text_2 = """
+    text_2 = normalize_whitespace(
+        """
     Making a cup of tea is easy! First, you need to get some \
     water boiling. While that's happening, \
     grab a cup and put a tea bag in it. Once the water is \
@@ -60,7 +75,9 @@ def execute():
     And that's it! You've got yourself a delicious \
     cup of tea to enjoy.
     """
-    prompt_3 = """
+    )
+    prompt_3 = PromptTemplate(
+        """
     You will be provided with text delimited by triple quotes.
     If it contains a sequence of instructions, \
     re-write those instructions in the following format:
@@ -73,10 +90,11 @@ def execute():
     If the text does not contain a sequence of instructions, \
     then simply write \"No steps provided.\"
 
-    \"\"\"{}\"\"\"
+    \"\"\"{text}\"\"\"
 
     """
-    response_3 = get_completion(prompt_3.format(text_2))
+    )
+    response_3 = get_completion(prompt_3.render(text=text_2))
     print("Completion for Text 2:")
     print(response_3)
     # response
@@ -89,7 +107,8 @@ def execute():
     # Step 6 - Add some sugar or milk to taste.
     # Step 7 - Enjoy your delicious cup of tea!
 
-    text_3 = """
+    text_3 = normalize_whitespace(
+        """
     The sun is shining brightly today, and the birds are \
     singing. It's a beautiful day to go for a \
     walk in the park. The flowers are blooming, and the \
@@ -100,7 +119,8 @@ def execute():
     perfect day to spend time outdoors and appreciate the \
     beauty of nature.
     """
-    response_4 = get_completion(prompt_3.format(text_3))
+    )
+    response_4 = get_completion(prompt_3.render(text=text_3))
     print("Completion for Text 2:")
     print(response_4)
     # response
@@ -108,7 +128,8 @@ def execute():
     # No steps provided.
 
     # ** Tactic 4: "Few-shot" prompting
-    prompt_4 = """
+    prompt_4 = PromptTemplate(
+        """
     Your task is to answer in a consistent style.
     <child>: Teach me about patience.
 
@@ -119,7 +140,8 @@ def execute():
 
     <child>: Teach me about resilience.
     """
-    response_5 = get_completion(prompt_4)
+    )
+    response_5 = get_completion(prompt_4.render())
     print(response_5)
     # response
     # <grandparent>: Resilience is like a tree that bends with the wind but never breaks. It is the ability to bounce
@@ -130,7 +152,8 @@ def execute():
     # ** -------------------------------------------
 
     # ** Tactic 1: Specify the steps required to complete a task
-    text_4 = """
+    text_4 = normalize_whitespace(
+        """
     In a charming village, siblings Jack and Jill set out on \
     a quest to fetch water from a hilltop \
     well. As they climbed, singing joyfully, misfortune \
@@ -141,8 +164,10 @@ def execute():
     their adventurous spirits remained undimmed, and they \
     continued exploring with delight.
     """
+    )
     # ** example 1
-    prompt_5 = f"""
+    prompt_5 = PromptTemplate(
+        """
     Perform the following actions:
     1 - Summarize the following text delimited by triple \
     backticks with 1 sentence.
@@ -156,7 +181,8 @@ def execute():
     Text:
     ```{text_4}```
     """
-    response_6 = get_completion(prompt_5)
+    )
+    response_6 = get_completion(prompt_5.render(text_4=text_4))
     print("Completion for prompt 5:")
     print(response_6)
     # response
@@ -176,7 +202,8 @@ def execute():
     # }
 
     # ** example 2, Ask for output in a specified format
-    prompt_6 = f"""
+    prompt_6 = PromptTemplate(
+        """
     Your task is to perform the following actions:
     1 - Summarize the following text delimited by
         <> with 1 sentence.
@@ -194,7 +221,8 @@ def execute():
 
     Text: <{text_4}>
     """
-    response_7 = get_completion(prompt_6)
+    )
+    response_7 = get_completion(prompt_6.render(text_4=text_4))
     print("\nCompletion for prompt 6:")
     print(response_7)
     # response
@@ -214,7 +242,8 @@ def execute():
     # ** Tactic 2: Instruct the model to work out its own solution before rushing to a conclusion
     # This prompt (prompt_7) isn't making the model to workout the solution, but it's to look at the result and compare
     # The next prompt (prompt_8) makes the model to workout the solution
-    prompt_7 = """
+    prompt_7 = PromptTemplate(
+        """
     Determine if the student's solution is correct or not.
 
     Question:
@@ -236,13 +265,15 @@ def execute():
     3. Maintenance cost: 100,000 + 100x
     Total cost: 100x + 250x + 100,000 + 100x = 450x + 100,000
     """
-    response_8 = get_completion(prompt_7)
+    )
+    response_8 = get_completion(prompt_7.render())
     print(response_8)
     # response
     # The student's solution is correct.
 
     # This prompt (prompt_8) makes the model to workout the solution
-    prompt_8 = """
+    prompt_8 = PromptTemplate(
+        """
     Your task is to determine if the student's solution \
     is correct or not.
     To solve the problem do the following:
@@ -298,7 +329,8 @@ def execute():
     ```
     Actual solution:
     """
-    response_9 = get_completion(prompt_8)
+    )
+    response_9 = get_completion(prompt_8.render())
     print(response_9)
     # response
     # Let x be the size of the installation in square feet.
@@ -319,11 +351,13 @@ def execute():
     # ** Model Limitations: Hallucinations
     # ** ---------------------------------
 
-    prompt_9 = """
+    prompt_9 = PromptTemplate(
+        """
     Tell me about AeroGlide UltraSlim Smart Toothbrush by Boie
     """
+    )
     # Boie is a real company, the product name is not real
-    response_10 = get_completion(prompt_9)
+    response_10 = get_completion(prompt_9.render())
     print(response_10)
     # The AeroGlide UltraSlim Smart Toothbrush by Boie is a high-tech toothbrush that uses advanced sonic technology to
     # provide a deep and thorough clean. It features a slim and sleek design that makes it easy to hold and maneuver, \
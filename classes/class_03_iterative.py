@@ -1,9 +1,11 @@
-from IPython.display import HTML, display  # type: ignore
-
+from llm.evaluation import PromptEvaluation, max_words, print_comparison, required_fields, valid_html, word_count
 from main import get_completion
 
 
 def execute():
+    # Imported here so that they are only loaded when the lesson runs
+    from IPython.display import HTML, display  # type: ignore
+
     print("Welcome to class 03: Iterative")
     print("------------------------------")
 
@@ -260,6 +262,53 @@ def execute():
 
     display(HTML(response))
 
+    # ** Evaluate the prompt versions on every fact sheet at once
+    # Each version is run on each fact sheet concurrently, and the outputs are scored locally on the issues found
+    # above: the length, the product IDs and the HTML format
+    task = """
+    Your task is to help a marketing team create a
+    description for a retail website of a product based
+    on a technical fact sheet.
+
+    Write a product description based on the information
+    provided in the technical specifications delimited by
+    triple backticks.
+    """
+    retailers = """
+    The description is intended for furniture retailers,
+    so should be technical in nature and focus on the
+    materials the product is constructed from.
+
+    At the end of the description, include every 7-character
+    Product ID in the technical specification.
+    """
+    variants = {
+        "limited": task + "Use at most 50 words.\n\nTechnical specifications: ```{fact_sheet}```",
+        "retailers": task + retailers + "Use at most 50 words.\n\nTechnical specifications: ```{fact_sheet}```",
+        "html": task
+        + retailers
+        + "Format everything as HTML that can be used in a website.\n"
+        + "Place the description in a <div> element.\n\nTechnical specifications: ```{fact_sheet}```",
+    }
+    evaluation = PromptEvaluation(
+        variants,
+        {"chair": {"fact_sheet": fact_sheet_chair}},
+        {
+            "words": word_count,
+            "at most 50 words": max_words(50),
+            "product IDs": required_fields("SWC-100", "SWC-110"),
+            "valid HTML": valid_html,
+        },
+    )
+    print_comparison(evaluation.summary(evaluation.run()))
+
+    # Editing a version only runs its cells again
+    evaluation.variants["limited"] = task + "Use at most 40 words.\n\nTechnical specifications: ```{fact_sheet}```"
+    print_comparison(evaluation.summary(evaluation.run()))
+    print(evaluation.stats())
+    # response
+    # {'executed': 4, 'reused': 2, 'reuse_rate': 0.3333333333333333}
+
 
 if __name__ == "__main__":
     execute()
@@ -1,4 +1,8 @@
-from main import get_completion
+import asyncio
+
+from llm.reviews import ReviewSummarizer, print_progress
+from llm.templates import PromptTemplate, normalize_whitespace
+from main import agather_completions, get_completion
 
 
 def execute():
@@ -6,7 +10,8 @@ def execute():
     print("------------------------------")
 
     # ** Text to summarize
-    prod_review = """
+    prod_review = normalize_whitespace(
+        """
     Got this panda plush toy for my daughter's birthday, \
     who loves it and takes it everywhere. It's soft and \
     super cute, and its face has a friendly look. It's \
@@ -16,10 +21,12 @@ def execute():
     so I got to play with it myself before I gave it \
     to her.
     """
+    )
 
     # ** 1st prompt: Summarize with a word/sentence/character limit
     # ** Request to summarize limiting by the quantity of words, sentence or character
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Your task is to generate a short summary of a product \
     review from an ecommerce site.
 
@@ -28,15 +35,17 @@ def execute():
 
     Review: ```{prod_review}```
     """
+    )
 
-    response = get_completion(prompt)
+    response = get_completion(prompt.render(prod_review=prod_review))
     print(response)
     # response
     # Soft and cute panda plush toy loved by daughter, but a bit small for the price. Arrived early.
 
     # ** 2nd prompt: Summarize with a focus on shipping and delivery
     # ** Request to get focus on specific details
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Your task is to generate a short summary of a product \
     review from an ecommerce site to give feedback to the \
     Shipping deparmtment.
@@ -47,8 +56,9 @@ def execute():
 
     Review: ```{prod_review}```
     """
+    )
 
-    response = get_completion(prompt)
+    response = get_completion(prompt.render(prod_review=prod_review))
     print(response)
     # response
     # The panda plush toy arrived a day earlier than expected, but the customer felt it was a bit small for the price
@@ -56,7 +66,8 @@ def execute():
 
     # ** 3rd prompt: Summarize with a focus on price and value
     # ** Request to get focus on specific details
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Your task is to generate a short summary of a product \
     review from an ecommerce site to give feedback to the \
     pricing department, responsible for determining the \
@@ -68,8 +79,9 @@ def execute():
 
     Review: ```{prod_review}```
     """
+    )
 
-    response = get_completion(prompt)
+    response = get_completion(prompt.render(prod_review=prod_review))
     print(response)
     # response
     # The panda plush toy is soft, cute, and loved by the recipient, but the price may be too high for its size.
@@ -78,7 +90,8 @@ def execute():
     # as the next one
 
     # ** 4th prompt: Try "extract" instead of "summarize"
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Your task is to extract relevant information from \
     a product review from an ecommerce site to give \
     feedback to the Shipping department.
@@ -89,8 +102,9 @@ def execute():
 
     Review: ```{prod_review}```
     """
+    )
 
-    response = get_completion(prompt)
+    response = get_completion(prompt.render(prod_review=prod_review))
     print(response)
     # response
     # The product arrived a day earlier than expected.
@@ -99,7 +113,8 @@ def execute():
     review_1 = prod_review
 
     # review for a standing lamp
-    review_2 = """
+    review_2 = normalize_whitespace(
+        """
     Needed a nice lamp for my bedroom, and this one \
     had additional storage and not too high of a price \
     point. Got it fast - arrived in 2 days. The string \
@@ -111,9 +126,11 @@ def execute():
     to be a great company that cares about their customers \
     and products.
     """
+    )
 
     # review for an electric toothbrush
-    review_3 = """
+    review_3 = normalize_whitespace(
+        """
     My dental hygienist recommended an electric toothbrush, \
     which is why I got this. The battery life seems to be \
     pretty impressive so far. After initial charging and \
@@ -131,10 +148,12 @@ def execute():
     toothbrush makes me feel like I've been to the dentist \
     every day. My teeth feel sparkly clean!
     """
+    )
 
     # review for a blender
 
-    review_4 = """
+    review_4 = normalize_whitespace(
+        """
     So, they still had the 17 piece system on seasonal \
     sale for around $49 in the month of November, about \
     half off, but for some reason (call it price gouging) \
@@ -166,21 +185,27 @@ def execute():
     consumer loyalty to maintain sales. Got it in about \
     two days.
     """
+    )
 
     reviews = [review_1, review_2, review_3, review_4]
 
-    for i in range(len(reviews)):
-        prompt = f"""
-        Your task is to generate a short summary of a product \
-        review from an ecommerce site.
+    # The template is normalized once, and only the review changes on each prompt
+    prompt = PromptTemplate(
+        """
+    Your task is to generate a short summary of a product \
+    review from an ecommerce site.
 
-        Summarize the review below, delimited by triple \
-        backticks in at most 20 words.
+    Summarize the review below, delimited by triple \
+    backticks in at most 20 words.
 
-        Review: ```{reviews[i]}```
-        """
+    Review: ```{review}```
+    """
+    )
+    prompts = [prompt.render(review=review) for review in reviews]
 
-        response = get_completion(prompt)
+    # The reviews are independent from each other, so they can be summarized concurrently
+    responses = asyncio.run(agather_completions(prompts))
+    for i, response in enumerate(responses):
         print(i, response, "\n")
 
     # responses
@@ -193,6 +218,17 @@ def execute():
 
     # 3 Mixed review of a blender system with price gouging and decreased quality, but helpful tips for use.
 
+    # ** Summarize the reviews of many products for each department
+    # Large review files are streamed with `read_reviews("reviews.jsonl")` (or a CSV file): the reviews are
+    # summarized in parallel, then the summaries of each product are combined into a summary for each department
+    products = ["panda plush toy", "standing lamp", "electric toothbrush", "blender"]
+    summarizer = ReviewSummarizer()
+    for product, summaries in summarizer.run(zip(products, reviews)):
+        print(product)
+        for department, summary in summaries.items():
+            print(f"  {department}: {summary}")
+    print_progress(summarizer.stats())
+
 
 if __name__ == "__main__":
     execute()
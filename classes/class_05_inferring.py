@@ -1,3 +1,7 @@
+from llm.extraction import Attribute, extract
+from llm.sentiment import SentimentCascade
+from llm.templates import PromptTemplate, normalize_whitespace
+from llm.topics import TopicAlerts, TopicIndex
 from main import get_completion
 
 
@@ -5,7 +9,8 @@ def execute():
     print("Welcome to class 05: Inferring")
     print("------------------------------")
 
-    lamp_review = """
+    lamp_review = normalize_whitespace(
+        """
     Needed a nice lamp for my bedroom, and this one had \
     additional storage and not too high of a price point. \
     Got it fast.  The string to our lamp broke during the \
@@ -16,21 +21,25 @@ def execute():
     Lumina seems to me to be a great company that cares \
     about their customers and products!!
     """
+    )
 
     # Requesting for the sentiment of a text
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     What is the sentiment of the following product review,
     which is delimited with triple backticks?
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # The sentiment of the product review is positive.
 
     # Asking if a text sentiment is positive or negative
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     What is the sentiment of the following product review,
     which is delimited with triple backticks?
 
@@ -39,13 +48,38 @@ def execute():
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # positive
 
+    # Classifying the sentiment of many reviews with the prompt above. Most reviews are clearly positive or negative,
+    # so a local lexicon scorer answers for them, and only the reviews it is not confident about are sent to the model.
+    # `cascade.evaluate(reviews, labels)` measures the escalation rate and the agreement with the model of each
+    # threshold on a labelled sample
+    reviews = [
+        lamp_review,
+        "Great blender, works perfectly and it is easy to clean. Love it!",
+        "Terrible quality, the handle broke after a week and the refund took forever.",
+        "It arrived on Tuesday in a brown box, and it does what the box says.",
+    ]
+    cascade = SentimentCascade()
+    for result in cascade.classify_many(reviews):
+        print(
+            f"{result['label']} ({'model' if result['escalated'] else 'local'}, confidence {result['confidence']:.2f})"
+        )
+    print(cascade.stats())
+    # response
+    # positive (model, confidence 0.39)
+    # positive (local, confidence 0.83)
+    # negative (local, confidence 0.75)
+    # positive (model, confidence 0.00)
+    # {'classified': 4, 'escalated': 2, 'escalation_rate': 0.5}
+
     # Identifying types of emotions
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Identify a list of emotions that the writer of the \
     following review is expressing. Include no more than \
     five items in the list. Format your answer as a list of \
@@ -53,26 +87,30 @@ def execute():
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # happy, satisfied, grateful, impressed, content
 
     # Asking to identify anger
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Is the writer of the following review expressing anger?\
     The review is delimited with triple backticks. \
     Give your answer as either yes or no.
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # No
 
     # Requesting to extract specific details from a text
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Identify the following items from the review text:
     - Item purchased by reviewer
     - Company that made the item
@@ -86,7 +124,8 @@ def execute():
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # {
@@ -95,7 +134,8 @@ def execute():
     # }
 
     # Asking the model to do multiple tasks at the same time
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Identify the following items from the review text:
     - Sentiment (positive or negative)
     - Is the reviewer expressing anger? (true or false)
@@ -112,7 +152,8 @@ def execute():
 
     Review text: '''{lamp_review}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(lamp_review=lamp_review))
     print(response)
     # response
     # {
@@ -122,8 +163,29 @@ def execute():
     #     "Brand": "Lumina"
     # }
 
+    # Asking for the sentiment, the emotions, the anger, the item and the brand of a text with a single request,
+    # instead of one request for each of them like above. The answer is validated, and only the missing or invalid
+    # attributes are requested again
+    lamp_attributes = [
+        Attribute("Sentiment", choices=["positive", "negative"]),
+        Attribute("Emotions", list, "No more than five lower-case words the writer of the review is expressing"),
+        Attribute("Anger", bool, "Whether the writer of the review is expressing anger"),
+        Attribute("Item", description="The item purchased by the reviewer"),
+        Attribute("Brand", description="The company that made the item"),
+    ]
+    record = extract(lamp_review, lamp_attributes)
+    for name, value in record.items():
+        print(f"{name}: {value}")
+    # response
+    # Sentiment: positive
+    # Emotions: ['happy', 'satisfied', 'grateful', 'impressed', 'content']
+    # Anger: False
+    # Item: lamp with additional storage
+    # Brand: Lumina
+
     # Making the model to infer the multiples topics in a text
-    story = """
+    story = normalize_whitespace(
+        """
     In a recent survey conducted by the government,
     public sector employees were asked to rate their level
     of satisfaction with the department they work at.
@@ -150,7 +212,9 @@ def execute():
     address the concerns raised by employees in the survey and
     work towards improving job satisfaction across all departments.
     """
-    prompt = f"""
+    )
+    prompt = PromptTemplate(
+        """
     Determine five topics that are being discussed in the \
     following text, which is delimited by triple backticks.
 
@@ -160,7 +224,8 @@ def execute():
 
     Text sample: '''{story}'''
     """
-    response = get_completion(prompt)
+    )
+    response = get_completion(prompt.render(story=story))
     print(response)
     # response
     # government survey, job satisfaction, NASA, Social Security Administration, employee concerns
@@ -172,20 +237,29 @@ def execute():
     topic_list = ["nasa", "local government", "engineering", "employee satisfaction", "federal government"]
 
     # Creating news alerts
-    prompt = f"""
+    prompt = PromptTemplate(
+        """
     Determine whether each item in the following list of \
     topics is a topic in the text below, which
     is delimited with triple backticks.
 
     Give your answer as list with 0 or 1 for each topic.\
 
-    List of topics: {", ".join(topic_list)}
+    List of topics: {topics}
 
     Text sample: '''{story}'''
     """
-
-    response = get_completion(prompt)
-    print(response)
+    )
+
+    # The topics are indexed with their keywords once, and only the topics whose keywords are in the story are sent to
+    # the model for confirmation, a story without any skipping the request. The answer is parsed line by line as it is
+    # streamed, and the request is stopped as soon as every topic is there, or as soon as a line isn't a "topic: 0 or
+    # 1" one
+    topic_index = TopicIndex(topic_list, aliases={"nasa": ["national aeronautics and space administration"]})
+    alerts = TopicAlerts(topic_index, prompt)
+    topic_dict = alerts.detect(story)
+    for topic, value in topic_dict.items():
+        print(f"{topic}: {value}")
     # response
     # nasa: 1
     # local government: 0
@@ -193,8 +267,6 @@ def execute():
     # employee satisfaction: 1
     # federal government: 1
 
-    topic_dict = {i.split(": ")[0]: int(i.split(": ")[1]) for i in response.split(sep="\n")}
-
     if topic_dict["nasa"] == 1:
         print("ALERT: New NASA story!")
     # response
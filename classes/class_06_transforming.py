@@ -1,10 +1,12 @@
-from IPython.display import HTML, Markdown, display
-from redlines import Redlines
-
-from main import get_completion
+from llm.diff import WordDiff
+from llm.tracing import span
+from main import get_completion, get_completions
 
 
 def execute():
+    # Imported here so that they are only loaded when the lesson runs
+    from IPython.display import HTML, Markdown, display
+
     print("Welcome to class 06: Transforming")
     print("------------------------------")
 
@@ -61,16 +63,11 @@ def execute():
         "Mój klawisz Ctrl jest zepsuty",  # My keyboard has a broken control key
         "我的屏幕在闪烁",  # My screen is flashing
     ]
-    for issue in user_messages:
-        prompt = f"Tell me what language this is: ```{issue}```"
-        lang = get_completion(prompt)
+    # The messages are short and share the same instructions, so several of them are packed into each request
+    langs = get_completions(user_messages, instructions="Tell me what language this is:")
+    responses = get_completions(user_messages, instructions="Translate the following text to English and Korean:")
+    for issue, lang, response in zip(user_messages, langs, responses):
         print(f"Original message ({lang}): {issue}")
-
-        prompt = f"""
-        Translate the following  text to English \
-        and Korean: ```{issue}```
-        """
-        response = get_completion(prompt)
         print(response, "\n")
     # response
     # Original message (This is French.): La performance du système est plus lente que d'habitude.
@@ -163,13 +160,11 @@ def execute():
         "That medicine effects my ability to sleep. Have you heard of the butterfly affect?",  # Homonyms
         "This phrase is to cherck chatGPT for speling abilitty",  # spelling
     ]
-    for t in text:
-        prompt = f"""Proofread and correct the following text
-        and rewrite the corrected version. If you don't find
-        any errors, just say "No errors found". Don't use
-        any punctuation around the text:
-        ```{t}```"""
-        response = get_completion(prompt)
+    instructions = """Proofread and correct the following text
+    and rewrite the corrected version. If you don't find
+    any errors, just say "No errors found". Don't use
+    any punctuation around the text:"""
+    for response in get_completions(text, instructions=instructions):
         print(response)
     # response
     # The girl with the black and white puppies has a ball.
@@ -203,8 +198,10 @@ def execute():
     # for it. I think there might be other options that are bigger for the same price. On the positive side, it arrived
     # a day earlier than expected, so I got to play with it myself before I gave it to my daughter.
 
-    diff = Redlines(text, response)
-    display(Markdown(diff.output_markdown))  # prints the text making marks on the changes done
+    with span("word diff"):
+        diff = WordDiff(text, response)  # Redlines' marks, as minimal and faster on long texts
+        markdown = diff.output_markdown
+    display(Markdown(markdown))  # prints the text making marks on the changes done
 
     # ** Ask for a text to be revised, corrected and made more convincing with a specific output format
     prompt = f"""
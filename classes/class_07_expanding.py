@@ -1,4 +1,6 @@
-from main import get_completion
+from llm.dedup import NearDuplicateIndex
+from llm.diversity import diverse_drafts, diversity
+from main import get_completion, get_completions
 
 
 def execute():
@@ -107,9 +109,14 @@ def execute():
     # responses, with a higher temperature resulting in more diverse outputs, while a temperature of zero ensures
     # predictability and a more reliable system, making it suitable for applications where a predictable response is
     # desired, while a higher temperature is recommended for creative use cases seeking a wider variety of outputs.
-    response = get_completion(prompt, temperature=0.7)
-    print(response)
-    # response
+    # A single request generates three drafts of the reply for the agent to choose from, so the prompt is sent and paid
+    # for once, and the drafts almost identical to a previous one are dropped
+    drafts = get_completion(prompt, temperature=0.7, n=3)
+    distinct = diverse_drafts(drafts)
+    for number, draft in enumerate(distinct, 1):
+        print(f"Draft {number}:\n{draft}\n")
+    print(f"{len(distinct)} distinct drafts out of {len(drafts)}, diversity {diversity(distinct):.2f}")
+    # response (first draft)
     # Dear valued customer,
     #
     # Thank you for taking the time to share your review with us. We appreciate your feedback and apologize for any
@@ -132,6 +139,38 @@ def execute():
     # Best regards,
     # AI customer agent
 
+    # ** Reply once to the near-copies of a templated complaint
+    # The complaints differing only in case, punctuation or a few words get the reply of the first of them, so only
+    # one reply is generated for each group of near-duplicates
+    complaints = [
+        "My order arrived two weeks late and the box was damaged. I want a refund!",
+        "my order arrived two weeks late, and the box was damaged... I want a refund",
+        "My order arrived two weeks late and the box was damaged. I want a refund please!",
+        "The blender motor stopped working after a month, can I get a replacement?",
+    ]
+
+    def reply(texts):
+        return get_completions(
+            [
+                f"""
+    You are a customer service AI assistant.
+    Generate a short reply to the customer email delimited by ```, \
+    apologizing and suggesting that they can reach out to customer service.
+    Sign the email as `AI customer agent`.
+    Customer email: ```{text}```
+    """
+                for text in texts
+            ]
+        )
+
+    replies = NearDuplicateIndex()
+    for complaint, response in zip(complaints, replies.dedupe(complaints, reply)):
+        print(f"{complaint}\n{response}\n")
+    print(replies.stats())
+    # response
+    # {'threshold': 0.8, 'hits': 2, 'exact_hits': 1, 'misses': 2, 'hit_rate': 0.5, 'comparisons': 1, 'evictions': 0,
+    # 'entries': 2, 'hit_similarities': {'1.00': 1, '0.90': 1}}
+
 
 if __name__ == "__main__":
     execute()
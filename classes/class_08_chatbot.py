@@ -1,22 +1,20 @@
-import openai
-import panel as pn  # GUI
-
-pn.extension()
+from llm.memory import ConversationMemory
+from llm.stream_parser import JsonParser, StreamDivergedError, parse_stream
+from llm.tracing import span
+from main import aget_completion_from_messages, get_completion_from_messages
 
 
 def execute():
+    # Imported here so that they are only loaded when the lesson runs
+    import panel as pn  # GUI
+
+    from llm.transcript import ChatTranscript
+
+    pn.extension()
+
     print("Welcome to class 08: Chatbot")
     print("----------------------------")
 
-    def get_completion_from_messages(messages, model="gpt-3.5-turbo", temperature=0):
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,  # this is the degree of randomness of the model's output
-        )
-        # print(str(response.choices[0].message)) # print the response message and role
-        return response.choices[0].message["content"]
-
     messages = [
         {"role": "system", "content": "You are an assistant that speaks like Shakespeare."},
         {"role": "user", "content": "tell me a joke"},
@@ -63,24 +61,29 @@ def execute():
     # response
     # Your name is Isa.
 
-    def collect_messages(_):
+    async def collect_messages(_):
         prompt = inp.value_input
         inp.value = ""
         context.append({"role": "user", "content": f"{prompt}"})
-        response = get_completion_from_messages(context)
+        # Only the two rows of the new turn are added to the page, the previous ones are left untouched
+        answer = panels.add_turn(prompt)
+        # The response is shown token by token as it is generated, instead of after the whole of it
+        response = ""
+        async for delta in await aget_completion_from_messages(context.messages(), stream=True):
+            response += delta
+            panels.update_answer(answer, response)
+        panels.finish_turn()
         context.append({"role": "assistant", "content": f"{response}"})
-        panels.append(pn.Row("User:", pn.pane.Markdown(prompt, width=600)))
-        panels.append(
-            pn.Row("Assistant:", pn.pane.Markdown(response, width=600, style={"background-color": "#F6F6F6"}))
-        )
-        return pn.Column(*panels)
 
-    panels = []  # collect display
+    panels = ChatTranscript(max_rows=40, height=300)  # collect display
 
-    context = [
-        {
-            "role": "system",
-            "content": """
+    # The system prompt is always sent, the latest turns are kept up to the token budget and the older ones are
+    # summarized, so each turn costs about the same however long the conversation gets
+    context = ConversationMemory(
+        pinned=[
+            {
+                "role": "system",
+                "content": """
                 You are OrderBot, an automated service to collect orders for a pizza restaurant.
                 You first greet the customer, then collects the order,
                 and then asks if it's a pickup or delivery.
@@ -109,37 +112,52 @@ def execute():
                 sprite 3.00, 2.00, 1.00
                 bottled water 5.00
             """,
-        }
-    ]  # accumulate messages
+            }
+        ],
+        max_tokens=1500,
+    )  # accumulate messages
 
-    inp = pn.widgets.TextInput(value="Hi", placeholder="Enter text here…")
-    button_conversation = pn.widgets.Button(name="Chat!")
+    with span("panel dashboard"):
+        inp = pn.widgets.TextInput(value="Hi", placeholder="Enter text here…")
+        button_conversation = pn.widgets.Button(name="Chat!")
 
-    interactive_conversation = pn.bind(collect_messages, button_conversation)
+        button_conversation.on_click(collect_messages)
 
-    dashboard = pn.Column(
-        inp,
-        pn.Row(button_conversation),
-        pn.panel(interactive_conversation, loading_indicator=True, height=300),
-    )
+        dashboard = pn.Column(
+            inp,
+            pn.Row(button_conversation),
+            panels.panel,
+        )
 
     dashboard  # checck the example of the conversation in the images on the Notion notes
 
-    messages = context.copy()
+    context.wait()
+    # The widget update time of a turn stays about the same however many turns came before it
+    print(panels.render_stats())
+    messages = context.messages()
     messages.append(
         {
             "role": "system",
             "content": (
                 "create a json summary of the previous food order. Itemize the price for each item The fields should be"
                 " 1) pizza, include size 2) list of toppings 3) list of drinks, include size   4) list of sides include"
-                " size  5)total price "
+                " size  5)total price. Answer only with a JSON object with the keys: pizza, toppings, drinks, sides,"
+                " total_price."
             ),
         },
     )
     # The fields should be 1) pizza, price 2) list of toppings 3) list of drinks, include size include price  4) list
     # of sides include size include price, 5)total price '},
 
-    response = get_completion_from_messages(messages, temperature=0)
+    # The summary is validated as it is streamed, and the request is stopped once every field is there
+    order_schema = {"pizza": object, "toppings": list, "drinks": list, "sides": list, "total_price": float}
+    try:
+        response = parse_stream(
+            get_completion_from_messages(messages, temperature=0, stream=True), JsonParser(order_schema)
+        )
+    except StreamDivergedError:
+        # The answer isn't the expected JSON, so it is shown as it is
+        response = get_completion_from_messages(messages, temperature=0)
     print(response)
     # response, from the inputs given in the example of the Notion notes
     # {
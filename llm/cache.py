@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".completions_cache.db")
+
+
+def make_cache_key(model, messages, temperature, **params):
+    """
+    Builds the cache key of a chat completion request.
+
+    Args:
+        model (str): The model used for generating the completion.
+        messages (list[dict]): The messages sent to the model.
+        temperature (float): The degree of randomness of the model's output.
+        **params: Any other parameter sent to the API that changes its output.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical JSON of the request.
+    """
+    request = {"model": model, "messages": messages, "temperature": temperature, **params}
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of completions backed by SQLite, with LRU eviction by number of entries and by age.
+
+    Any object exposing the same `get`, `set` and `stats` methods can be plugged with `set_cache` instead.
+
+    Args:
+        path (str): (Optional) The SQLite database file. Defaults to `.completions_cache.db` in the repository root.
+        max_entries (int): (Optional) The maximum number of stored completions. Defaults to 10000.
+        max_age (float): (Optional) The seconds after which a completion expires. Defaults to None, never expire.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=10000, max_age=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+
+    def get(self, key):
+        """
+        Looks up a completion, refreshing its position in the LRU order.
+
+        Args:
+            key (str): The key built with `make_cache_key`.
+
+        Returns:
+            str | None: The cached completion, or None when it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response):
+        """
+        Stores a completion, evicting the least recently used ones when the cache is over its limits.
+
+        Args:
+            key (str): The key built with `make_cache_key`.
+            response (str): The completion to store.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        if self.max_age is not None:
+            cursor = self._connection.execute("DELETE FROM completions WHERE created_at < ?", (now - self.max_age,))
+            self.evictions += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self._connection.execute(
+                """
+                DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self.evictions += cursor.rowcount
+
+    def clear(self):
+        """
+        Removes every stored completion and resets the counters.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: The number of hits, misses, evictions and stored entries.
+        """
+        with self._lock:
+            (entries,) = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": entries}
+
+    def close(self):
+        """
+        Closes the underlying database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the cache used by the completion functions, creating the default on-disk cache on first use.
+
+    Setting the `COMPLETIONS_CACHE` environment variable to `0` disables the default cache, and
+    `COMPLETIONS_CACHE_PATH` changes its location.
+
+    Returns:
+        ResponseCache | None: The active cache, or None when caching is disabled.
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        if not _cache_configured:
+            if os.getenv("COMPLETIONS_CACHE", "1") != "0":
+                _cache = ResponseCache(os.getenv("COMPLETIONS_CACHE_PATH", DEFAULT_CACHE_PATH))
+            _cache_configured = True
+    return _cache
+
+
+def set_cache(cache):
+    """
+    Replaces the cache used by the completion functions.
+
+    Args:
+        cache (ResponseCache | None): Any object with `get`, `set` and `stats` methods, or None to disable caching.
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
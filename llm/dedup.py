@@ -0,0 +1,304 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_MAX_ENTRIES = 10000
+SHINGLE_SIZE = 2
+
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# The value of the entries whose result is being computed
+_PENDING = object()
+
+
+def normalize_text(text):
+    """
+    Reduces a text to what changes its meaning, so texts differing only in case, punctuation, whitespace or Unicode
+    forms are equal.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The lower-case words of the text separated by single spaces.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _WHITESPACE_PATTERN.sub(" ", _PUNCTUATION_PATTERN.sub(" ", text)).strip()
+
+
+def shingles(normalized, size=SHINGLE_SIZE):
+    """
+    Splits a normalized text in the overlapping runs of words compared between texts.
+
+    Args:
+        normalized (str): The text returned by `normalize_text`.
+        size (int): (Optional) The words of each shingle. Defaults to `SHINGLE_SIZE`.
+
+    Returns:
+        set[str]: The shingles, or the whole text when it has fewer words than a shingle.
+    """
+    words = normalized.split(" ")
+    if len(words) <= size:
+        return {normalized}
+    return {" ".join(words[start : start + size]) for start in range(len(words) - size + 1)}
+
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash(normalized, num_perm=DEFAULT_NUM_PERM):
+    """
+    Computes the MinHash signature of a normalized text, with one permutation hashing: each shingle is hashed once,
+    the low bits of the hash pick one of `num_perm` bins and each bin keeps its minimum, which is as accurate as
+    `num_perm` hash functions for a fraction of the time.
+
+    Args:
+        normalized (str): The text returned by `normalize_text`.
+        num_perm (int): (Optional) The bins of the signature, a power of 2. Defaults to `DEFAULT_NUM_PERM`.
+
+    Returns:
+        tuple[int | None, ...]: The minimum of each bin, None for the bins without any shingle.
+    """
+    mask = num_perm - 1
+    shift = mask.bit_length()
+    bins = [None] * num_perm
+    for shingle in shingles(normalized):
+        value = _hash(shingle)
+        position, value = value & mask, value >> shift
+        if bins[position] is None or value < bins[position]:
+            bins[position] = value
+    return tuple(bins)
+
+
+def similarity(signature, other):
+    """
+    Estimates the Jaccard similarity of the shingles of two texts from their signatures.
+
+    Args:
+        signature (tuple): The signature of a text, see `minhash`.
+        other (tuple): The signature of the other text.
+
+    Returns:
+        float: The fraction of the bins filled in either signature that hold the same minimum in both, from 0 to 1.
+    """
+    filled = equal = 0
+    for value, other_value in zip(signature, other):
+        if value is None and other_value is None:
+            continue
+        filled += 1
+        equal += value == other_value
+    return equal / filled if filled else 1.0
+
+
+class NearDuplicateIndex:
+    """
+    Memory-bounded index of the results of previous inputs, finding the results of the inputs almost identical to a
+    new one, like templated complaints, reposts or copies differing only in punctuation.
+
+    The inputs are normalized with `normalize_text`, an exact match of the normalized text is found with a dict, and
+    the near-duplicates with locality-sensitive hashing of the MinHash signatures: the signature is cut in `bands`,
+    and only the entries sharing a band with the input are compared with it. The least recently used entries are
+    evicted beyond `max_entries`.
+
+    Args:
+        threshold (float): (Optional) The estimated Jaccard similarity from which an entry is a near-duplicate of an
+            input, above 1 only reuses exact matches. Defaults to `DEFAULT_THRESHOLD`.
+        num_perm (int): (Optional) The bins of the signatures, a power of 2. Defaults to `DEFAULT_NUM_PERM`.
+        bands (int): (Optional) The bands of the signatures, dividing `num_perm`. More bands find more candidates at
+            lower similarities, for more comparisons. Defaults to `DEFAULT_BANDS`.
+        max_entries (int): (Optional) The maximum number of stored results. Defaults to `DEFAULT_MAX_ENTRIES`.
+    """
+
+    def __init__(
+        self,
+        threshold=DEFAULT_THRESHOLD,
+        num_perm=DEFAULT_NUM_PERM,
+        bands=DEFAULT_BANDS,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ):
+        if num_perm & (num_perm - 1) or num_perm % bands:
+            raise ValueError("num_perm must be a power of 2 and a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.comparisons = 0
+        self.hit_similarities = {}
+        self._entries = OrderedDict()
+        self._exact = {}
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _bands(self, signature):
+        for band in range(self.bands):
+            values = signature[band * self.rows : (band + 1) * self.rows]
+            # The bands without any shingle would make every short text a candidate of every other
+            if any(value is not None for value in values):
+                yield band, values
+
+    def _signature(self, text):
+        normalized = normalize_text(text)
+        return normalized, minhash(normalized, self.num_perm)
+
+    def _record_hit(self, entry_id, score, exact):
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        self.exact_hits += exact
+        # The similarities of the hits are counted in steps of 0.05, to tune the threshold
+        step = f"{int(score * 20) / 20:.2f}"
+        self.hit_similarities[step] = self.hit_similarities.get(step, 0) + 1
+
+    def _usable(self, entry_id, pending):
+        # The results computed by another batch are only reused once they are there
+        return self._entries[entry_id][2] is not _PENDING or entry_id in pending
+
+    def _find(self, normalized, signature, pending=()):
+        entry_id = self._exact.get(normalized)
+        if entry_id is not None and self._usable(entry_id, pending):
+            self._record_hit(entry_id, 1.0, True)
+            return entry_id, 1.0
+        best_id, best_score = None, 0.0
+        if self.threshold <= 1:
+            candidates = {entry_id for band in self._bands(signature) for entry_id in self._buckets.get(band, ())}
+            for entry_id in candidates:
+                if not self._usable(entry_id, pending):
+                    continue
+                self.comparisons += 1
+                score = similarity(signature, self._entries[entry_id][1])
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+        if best_id is None or best_score < self.threshold:
+            self.misses += 1
+            return None, best_score
+        self._record_hit(best_id, best_score, False)
+        return best_id, best_score
+
+    def lookup(self, text):
+        """
+        Finds the result of the most similar previous input.
+
+        Args:
+            text (str): The input.
+
+        Returns:
+            tuple[Any, float] | None: The result and the estimated similarity of its input, or None when no input is
+            similar enough.
+        """
+        normalized, signature = self._signature(text)
+        with self._lock:
+            entry_id, score = self._find(normalized, signature)
+            return None if entry_id is None else (self._entries[entry_id][2], score)
+
+    def _add(self, normalized, signature, value):
+        entry_id = self._exact.get(normalized)
+        if entry_id is not None:
+            self._remove(entry_id)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = [normalized, signature, value]
+        self._exact[normalized] = entry_id
+        for band in self._bands(signature):
+            self._buckets.setdefault(band, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return entry_id
+
+    def _remove(self, entry_id):
+        normalized, signature, _ = self._entries.pop(entry_id)
+        del self._exact[normalized]
+        for band in self._bands(signature):
+            bucket = self._buckets[band]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[band]
+
+    def add(self, text, value):
+        """
+        Stores the result of an input, evicting the least recently used ones when the index is full.
+
+        Args:
+            text (str): The input.
+            value (Any): Its result.
+        """
+        normalized, signature = self._signature(text)
+        with self._lock:
+            self._add(normalized, signature, value)
+
+    def dedupe(self, texts, complete):
+        """
+        Computes the results of inputs, reusing the results of the previous near-duplicates and computing only one
+        canonical input of each group of near-duplicates of the batch.
+
+        Args:
+            texts (list[str]): The inputs.
+            complete (Callable[[list[str]], list]): Computes the results of the canonical inputs, in the same order.
+
+        Returns:
+            list: The result of each input, in the same order.
+        """
+        results = [None] * len(texts)
+        # The position of each input among the canonical inputs, or its reused result
+        canonical, pending, reused = [], {}, {}
+        signatures = [self._signature(text) for text in texts]
+        with self._lock:
+            for position, (normalized, signature) in enumerate(signatures):
+                entry_id, _ = self._find(normalized, signature, pending)
+                if entry_id is None:
+                    entry_id = self._add(normalized, signature, _PENDING)
+                    pending[entry_id] = len(canonical)
+                    canonical.append(position)
+                if entry_id in pending:
+                    reused[position] = pending[entry_id]
+                else:
+                    results[position] = self._entries[entry_id][2]
+        try:
+            values = complete([texts[position] for position in canonical]) if canonical else []
+        except BaseException:
+            # The placeholders of the failed inputs are dropped, so they are computed again next time
+            with self._lock:
+                for entry_id in pending:
+                    if entry_id in self._entries and self._entries[entry_id][2] is _PENDING:
+                        self._remove(entry_id)
+            raise
+        with self._lock:
+            for entry_id, index in pending.items():
+                if entry_id in self._entries and self._entries[entry_id][2] is _PENDING:
+                    self._entries[entry_id][2] = values[index]
+        for position, index in reused.items():
+            results[position] = values[index]
+        return results
+
+    def stats(self):
+        """
+        Returns the counters of the index.
+
+        Returns:
+            dict: The threshold, the hits and the exact ones among them, the misses, the hit rate, the signatures
+            compared, the evictions, the stored entries and the hits for each step of 0.05 of similarity.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "exact_hits": self.exact_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "comparisons": self.comparisons,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hit_similarities": dict(sorted(self.hit_similarities.items(), reverse=True)),
+            }
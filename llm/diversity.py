@@ -0,0 +1,79 @@
+import zlib
+
+from llm.dedup import normalize_text, shingles
+
+DEFAULT_NGRAM_SIZE = 2
+DEFAULT_MAX_SIMILARITY = 0.7
+
+
+def ngram_similarity(texts, size=DEFAULT_NGRAM_SIZE):
+    """
+    Computes the Jaccard similarity of the word n-grams of every pair of texts at once, with a matrix product of their
+    n-gram indicator vectors.
+
+    Args:
+        texts (list[str]): The texts, compared once normalized with `llm.dedup.normalize_text`.
+        size (int): (Optional) The words of each n-gram. Defaults to `DEFAULT_NGRAM_SIZE`.
+
+    Returns:
+        numpy.ndarray: The square matrix of the similarities, from 0 for texts without any common n-gram to 1 for
+        texts with the same ones.
+    """
+    import numpy as np
+
+    grams = [[zlib.crc32(gram.encode("utf-8")) for gram in shingles(normalize_text(text), size)] for text in texts]
+    rows = np.repeat(np.arange(len(texts)), [len(text_grams) for text_grams in grams])
+    # Each distinct n-gram of the texts gets a column, so the vectors have no hashing collisions
+    columns, inverse = np.unique(
+        np.fromiter((gram for text_grams in grams for gram in text_grams), np.int64), return_inverse=True
+    )
+    vectors = np.zeros((len(texts), len(columns)), dtype=np.float32)
+    vectors[rows, inverse] = 1
+    common = vectors @ vectors.T
+    counts = np.diag(common)
+    union = counts[:, None] + counts[None, :] - common
+    return np.divide(common, union, out=np.ones_like(common), where=union > 0)
+
+
+def diverse_drafts(drafts, max_similarity=DEFAULT_MAX_SIMILARITY, size=DEFAULT_NGRAM_SIZE):
+    """
+    Drops the drafts almost identical to a previous one, like the samples of a completion that only differ in a few
+    words.
+
+    Args:
+        drafts (list[str]): The drafts, in order of preference.
+        max_similarity (float): (Optional) The n-gram similarity to every kept draft a draft must stay under to be
+            kept. Defaults to `DEFAULT_MAX_SIMILARITY`.
+        size (int): (Optional) The words of each n-gram. Defaults to `DEFAULT_NGRAM_SIZE`.
+
+    Returns:
+        list[str]: The first draft, and every following one different enough from the ones kept before it.
+    """
+    if len(drafts) < 2:
+        return list(drafts)
+    similarities = ngram_similarity(drafts, size)
+    kept = [0]
+    for index in range(1, len(drafts)):
+        if similarities[index, kept].max() < max_similarity:
+            kept.append(index)
+    return [drafts[index] for index in kept]
+
+
+def diversity(texts, size=DEFAULT_NGRAM_SIZE):
+    """
+    Scores how different texts are from each other.
+
+    Args:
+        texts (list[str]): The texts.
+        size (int): (Optional) The words of each n-gram. Defaults to `DEFAULT_NGRAM_SIZE`.
+
+    Returns:
+        float: One minus the mean n-gram similarity of the pairs of texts, 0 when there are fewer than two.
+    """
+    import numpy as np
+
+    if len(texts) < 2:
+        return 0.0
+    similarities = ngram_similarity(texts, size)
+    pairs = np.triu_indices(len(texts), k=1)
+    return float(1 - similarities[pairs].mean())
@@ -0,0 +1,222 @@
+import re
+from html.parser import HTMLParser
+
+from llm.cache import make_cache_key
+from llm.templates import PromptTemplate
+
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+# The elements without an end tag
+_VOID_ELEMENTS = frozenset("area base br col embed hr img input link meta source track wbr".split())
+
+
+def word_count(output):
+    """
+    Counts the words of an output, without its HTML tags.
+
+    Args:
+        output (str): The output.
+
+    Returns:
+        int: The number of words.
+    """
+    return len(_TAG_PATTERN.sub(" ", output).split())
+
+
+def max_words(limit):
+    """
+    Builds a metric checking the length of the outputs.
+
+    Args:
+        limit (int): The maximum number of words, see `word_count`.
+
+    Returns:
+        Callable[[str], bool]: Whether an output has at most `limit` words.
+    """
+
+    def metric(output):
+        return word_count(output) <= limit
+
+    return metric
+
+
+def required_fields(*fields):
+    """
+    Builds a metric checking that the outputs mention some fields, like product IDs or a table title.
+
+    Args:
+        *fields (str): The fields, matched ignoring the case.
+
+    Returns:
+        Callable[[str], float]: The fraction of the fields an output mentions.
+    """
+    fields = [field.lower() for field in fields]
+
+    def metric(output):
+        output = output.lower()
+        return sum(field in output for field in fields) / len(fields) if fields else 1.0
+
+    return metric
+
+
+class _TagBalance(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open_tags = []
+        self.tags = 0
+        self.errors = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.tags += 1
+        if tag not in _VOID_ELEMENTS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_ELEMENTS:
+            return
+        if not self.open_tags or self.open_tags[-1] != tag:
+            self.errors += 1
+            if tag in self.open_tags:
+                del self.open_tags[self.open_tags.index(tag) :]
+            return
+        self.open_tags.pop()
+
+
+def valid_html(output):
+    """
+    Checks that an output is well-formed HTML: it has some elements, and each one is closed in the order it was
+    opened.
+
+    Args:
+        output (str): The output.
+
+    Returns:
+        bool: Whether the output is well-formed HTML.
+    """
+    parser = _TagBalance()
+    parser.feed(output)
+    parser.close()
+    return parser.tags > 0 and not parser.errors and not parser.open_tags
+
+
+class PromptEvaluation:
+    """
+    Evaluation of prompt variants on a set of inputs, running every cell of the variants by inputs matrix
+    concurrently and scoring its output with local metrics.
+
+    The outputs are kept by prompt, so running the evaluation again after editing a variant, or adding an input,
+    only sends the cells whose prompt changed. With a temperature of 0 the outputs also come from the response cache
+    of the previous runs.
+
+    Args:
+        variants (dict[str, PromptTemplate | str]): The prompt of each variant, with placeholders for the values of
+            the inputs.
+        inputs (dict[str, dict[str, str]]): The values of the placeholders for each input.
+        metrics (dict[str, Callable[[str], bool | float]]): The local metrics scoring each output, like `max_words`,
+            `required_fields` or `valid_html`.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        max_workers (int): (Optional) The maximum number of requests in flight at once. Defaults to 16.
+    """
+
+    def __init__(self, variants, inputs, metrics, model="gpt-3.5-turbo", temperature=0, max_workers=16):
+        self.variants = dict(variants)
+        self.inputs = dict(inputs)
+        self.metrics = dict(metrics)
+        self.model = model
+        self.temperature = temperature
+        self.max_workers = max_workers
+        self.executed = 0
+        self.reused = 0
+        self._outputs = {}
+
+    def _prompt(self, variant, values):
+        template = self.variants[variant]
+        if not isinstance(template, PromptTemplate):
+            template = self.variants[variant] = PromptTemplate(template)
+        return template.render(**values)
+
+    def _key(self, prompt):
+        return make_cache_key(self.model, [{"role": "user", "content": prompt}], self.temperature)
+
+    def run(self):
+        """
+        Runs the cells of the matrix whose prompt has no output yet, and scores every cell.
+
+        Returns:
+            list[dict]: The "variant", the "input", the "output" and the value of each metric of each cell.
+        """
+        from main import get_completions
+
+        cells = [
+            (variant, name, self._prompt(variant, values))
+            for variant in self.variants
+            for name, values in self.inputs.items()
+        ]
+        # The cells sharing a prompt, and the prompts already run, are sent once
+        missing = {}
+        for _, _, prompt in cells:
+            key = self._key(prompt)
+            if key not in self._outputs:
+                missing.setdefault(key, prompt)
+        outputs = get_completions(
+            list(missing.values()), model=self.model, temperature=self.temperature, max_workers=self.max_workers
+        )
+        self._outputs.update(zip(missing, outputs))
+        self.executed += len(missing)
+        self.reused += len(cells) - len(missing)
+
+        rows = []
+        for variant, name, prompt in cells:
+            output = self._outputs[self._key(prompt)]
+            row = {"variant": variant, "input": name, "output": output}
+            row.update((metric, function(output)) for metric, function in self.metrics.items())
+            rows.append(row)
+        return rows
+
+    def summary(self, rows):
+        """
+        Aggregates the metrics of each variant over the inputs.
+
+        Args:
+            rows (list[dict]): The rows returned by `run`.
+
+        Returns:
+            dict[str, dict[str, float]]: For each variant, the mean of each metric, which is the pass rate of the
+            metrics returning a bool.
+        """
+        totals = {variant: {metric: 0.0 for metric in self.metrics} for variant in self.variants}
+        counts = dict.fromkeys(self.variants, 0)
+        for row in rows:
+            counts[row["variant"]] += 1
+            for metric in self.metrics:
+                totals[row["variant"]][metric] += float(row[metric])
+        return {
+            variant: {metric: total / counts[variant] if counts[variant] else 0.0 for metric, total in metrics.items()}
+            for variant, metrics in totals.items()
+        }
+
+    def stats(self):
+        """
+        Returns the counters of the runs.
+
+        Returns:
+            dict: The cells sent to the model, the cells reusing the output of a previous run or of another cell, and
+            the fraction reused.
+        """
+        cells = self.executed + self.reused
+        return {"executed": self.executed, "reused": self.reused, "reuse_rate": self.reused / cells if cells else 0.0}
+
+
+def print_comparison(summary):
+    """
+    Prints the summary returned by `PromptEvaluation.summary` as a table, one row for each variant.
+
+    Args:
+        summary (dict[str, dict[str, float]]): The summary.
+    """
+    columns = list(next(iter(summary.values()), {}))
+    width = max([len("variant")] + [len(variant) for variant in summary]) + 2
+    widths = [max(len(name), 8) + 2 for name in columns]
+    print(f"{'variant':<{width}}" + "".join(f"{name:>{size}}" for name, size in zip(columns, widths)))
+    for variant, metrics in summary.items():
+        print(f"{variant:<{width}}" + "".join(f"{metrics[name]:>{size}.2f}" for name, size in zip(columns, widths)))
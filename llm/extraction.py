@@ -0,0 +1,228 @@
+import json
+
+from llm.templates import PromptTemplate
+
+TYPE_NAMES = {str: "string", bool: "boolean", int: "integer", float: "number", list: "list of strings"}
+
+_BOOLEANS = {"true": True, "yes": True, "false": False, "no": False}
+
+EXTRACTION_PROMPT = PromptTemplate(
+    """
+    Extract the following fields from the text delimited by triple backticks.
+    Answer with a single JSON object with these keys:
+    {fields}
+    Use null as the value of a field when the information isn't present in the text.
+
+    Text: ```{text}```
+    """
+)
+CORRECTION_PROMPT = PromptTemplate(
+    """
+    Your answer {problem}.
+    Answer again with a single JSON object with only these keys:
+    {fields}
+    Use null as the value of a field when the information isn't present in the text.
+    """
+)
+
+
+class ExtractionError(ValueError):
+    """
+    Raised when some attributes are still missing or invalid after every extraction attempt.
+
+    Args:
+        message (str): The error message.
+        record (dict): The attributes extracted so far.
+        missing (list[str]): The names of the attributes that couldn't be extracted.
+    """
+
+    def __init__(self, message, record, missing):
+        super().__init__(message)
+        self.record = record
+        self.missing = missing
+
+
+class Attribute:
+    """
+    Attribute to extract from a text.
+
+    Args:
+        name (str): The key of the attribute in the extracted record.
+        type (type): (Optional) The type of the value, one of str, bool, int, float or list. Defaults to str.
+        description (str): (Optional) What the attribute is, as told to the model. Defaults to none.
+        choices (list[str]): (Optional) The allowed values of a str attribute. Defaults to any value.
+    """
+
+    def __init__(self, name, type=str, description="", choices=None):
+        if type not in TYPE_NAMES:
+            raise ValueError(
+                f"Unsupported attribute type {type!r}, use one of {', '.join(t.__name__ for t in TYPE_NAMES)}"
+            )
+        self.name = name
+        self.type = type
+        self.description = description
+        self.choices = list(choices) if choices else None
+
+    def describe(self):
+        """
+        Returns the line of the extraction prompt that asks for the attribute.
+
+        Returns:
+            str: The description of the key, its type and its allowed values.
+        """
+        kind = TYPE_NAMES[self.type]
+        if self.choices:
+            kind += ", one of: " + ", ".join(json.dumps(choice) for choice in self.choices)
+        line = f'- "{self.name}" ({kind})'
+        return f"{line}: {self.description}" if self.description else line
+
+    def validate(self, value):
+        """
+        Converts an extracted value to the attribute type.
+
+        Args:
+            value (Any): The value decoded from the model answer.
+
+        Returns:
+            Any: The converted value, None when the model answered null.
+
+        Raises:
+            ValueError: When the value can't be converted, or isn't one of the allowed choices.
+        """
+        if value is None:
+            return None
+        if self.type is bool:
+            if isinstance(value, str) and value.strip().lower() in _BOOLEANS:
+                return _BOOLEANS[value.strip().lower()]
+            if isinstance(value, bool):
+                return value
+        elif self.type is int:
+            if isinstance(value, (int, str)) and not isinstance(value, bool):
+                return int(value)
+        elif self.type is float:
+            if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+                return float(value)
+        elif self.type is list:
+            if isinstance(value, str):
+                value = value.split(",")
+            if isinstance(value, list):
+                return [str(item).strip() for item in value if str(item).strip()]
+        elif isinstance(value, (str, int, float)):
+            value = str(value).strip()
+            if not self.choices:
+                return value
+            for choice in self.choices:
+                if choice.lower() == value.lower():
+                    return choice
+            raise ValueError(f"{value!r} isn't one of the choices of {self.name}")
+        raise ValueError(f"{value!r} isn't a valid {TYPE_NAMES[self.type]} for {self.name}")
+
+
+def build_extraction_prompt(text, attributes):
+    """
+    Builds the prompt asking for all the attributes of a text at once.
+
+    Args:
+        text (str): The text to extract the attributes from.
+        attributes (list[Attribute]): The attributes.
+
+    Returns:
+        str: The prompt.
+    """
+    return EXTRACTION_PROMPT.render(fields="\n".join(attribute.describe() for attribute in attributes), text=text)
+
+
+def _decode_object(response):
+    start, end = response.find("{"), response.rfind("}")
+    try:
+        answer = json.loads(response[start : end + 1]) if start != -1 else None
+    except json.JSONDecodeError:
+        return None
+    return answer if isinstance(answer, dict) else None
+
+
+def build_correction_prompt(response, attributes):
+    """
+    Builds the prompt telling the model what was wrong with its previous answer, and asking again for the attributes
+    it missed.
+
+    Args:
+        response (str): The previous answer.
+        attributes (list[Attribute]): The attributes missing or invalid in the answer.
+
+    Returns:
+        str: The prompt.
+    """
+    if _decode_object(response) is None:
+        problem = "isn't a JSON object"
+    else:
+        problem = "has missing or invalid values for " + ", ".join(
+            json.dumps(attribute.name) for attribute in attributes
+        )
+    return CORRECTION_PROMPT.render(problem=problem, fields="\n".join(attribute.describe() for attribute in attributes))
+
+
+def parse_record(response, attributes):
+    """
+    Decodes and validates the JSON object answered by the model, keeping the valid attributes.
+
+    Args:
+        response (str): The model answer.
+        attributes (list[Attribute]): The requested attributes.
+
+    Returns:
+        tuple[dict, list[Attribute]]: The valid attributes by name, and the attributes missing or invalid.
+    """
+    answer = _decode_object(response)
+    if answer is None:
+        return {}, list(attributes)
+
+    record, missing = {}, []
+    for attribute in attributes:
+        if attribute.name not in answer:
+            missing.append(attribute)
+            continue
+        try:
+            record[attribute.name] = attribute.validate(answer[attribute.name])
+        except ValueError:
+            missing.append(attribute)
+    return record, missing
+
+
+def extract(text, attributes, model="gpt-3.5-turbo", max_attempts=3, use_cache=None):
+    """
+    Extracts several attributes of a text with a single request, instead of one request per attribute.
+
+    When the answer misses some attributes, or has invalid values, only those are requested again, in the same
+    conversation with the previous answer and what was wrong with it, so a deterministic model doesn't repeat it.
+
+    Args:
+        text (str): The text to extract the attributes from.
+        attributes (list[Attribute]): The attributes.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+        max_attempts (int): (Optional) The requests made at most. Defaults to 3.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only cache
+            deterministic (temperature 0) calls.
+
+    Returns:
+        dict: The value of each attribute by name, None for the information that isn't present in the text.
+
+    Raises:
+        ExtractionError: When some attributes are still missing after `max_attempts` requests.
+    """
+    from main import get_completion_from_messages
+
+    record, missing = {}, list(attributes)
+    messages = [{"role": "user", "content": build_extraction_prompt(text, missing)}]
+    for _ in range(max_attempts):
+        response = get_completion_from_messages(messages, model=model, use_cache=use_cache)
+        extracted, missing = parse_record(response, missing)
+        record.update(extracted)
+        if not missing:
+            return {attribute.name: record[attribute.name] for attribute in attributes}
+        messages += [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": build_correction_prompt(response, missing)},
+        ]
+    names = [attribute.name for attribute in missing]
+    raise ExtractionError(f"Couldn't extract {', '.join(names)} after {max_attempts} attempts", record, names)
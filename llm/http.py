@@ -0,0 +1,124 @@
+import os
+import threading
+from contextlib import asynccontextmanager
+
+import aiohttp
+import openai
+import requests
+
+from llm.rate_limit import get_rate_limiter, response_hook
+
+DEFAULT_POOL_SIZE = 32
+# Seconds an idle connection is kept open waiting to be reused
+KEEPALIVE_TIMEOUT = 60
+
+_session = None
+_session_lock = threading.Lock()
+_async_stats = {"opened": 0, "reused": 0}
+
+
+def _pool_size():
+    return int(os.getenv("OPENAI_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def _make_session(pool_size):
+    session = requests.Session()
+    if openai.proxy:
+        session.proxies = (
+            openai.proxy if isinstance(openai.proxy, dict) else {"http": openai.proxy, "https": openai.proxy}
+        )
+    # Each host pool is sized for the threads sharing it. Blocking when it is exhausted keeps every request on a
+    # kept-alive connection instead of opening extra ones that are thrown away afterwards.
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=openai.api_requestor.MAX_CONNECTION_RETRIES,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(response_hook)
+    return session
+
+
+def get_session():
+    """
+    Returns the HTTP session shared by every thread making synchronous API calls, created on first use.
+
+    Its connection pool holds up to `OPENAI_POOL_SIZE` (default 32) kept-alive connections per host. The transport of
+    the openai library is HTTP/1.1 only, so connection reuse is what saves the TLS handshakes.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _make_session(_pool_size())
+            openai.requestssession = _session
+    return _session
+
+
+async def _on_request_end(session, context, params):
+    get_rate_limiter().update_from_headers(params.response.headers)
+
+
+async def _on_connection_create_end(session, context, params):
+    _async_stats["opened"] += 1
+
+
+async def _on_connection_reuseconn(session, context, params):
+    _async_stats["reused"] += 1
+
+
+@asynccontextmanager
+async def async_session(limit=None):
+    """
+    Opens a pooled aiohttp session and makes it the one used by the asynchronous API calls of the current context.
+
+    aiohttp sessions are bound to their event loop, so a new one is needed for each `asyncio.run`.
+
+    Args:
+        limit (int): (Optional) The maximum number of connections. Defaults to `OPENAI_POOL_SIZE`.
+
+    Yields:
+        aiohttp.ClientSession: The session.
+    """
+    connector = aiohttp.TCPConnector(limit=limit or _pool_size(), keepalive_timeout=KEEPALIVE_TIMEOUT)
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[trace_config]) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
+
+
+def pool_stats():
+    """
+    Returns the connection pool counters of the synchronous and asynchronous sessions.
+
+    Returns:
+        dict: The connections opened and reused, the requests sent and the idle connections of the shared session,
+        and the connections opened and reused by the asynchronous sessions.
+    """
+    opened = requests_sent = idle = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                opened += pool.num_connections
+                requests_sent += pool.num_requests
+                if pool.pool is not None:
+                    idle += sum(connection is not None for connection in list(pool.pool.queue))
+    return {
+        "opened": opened,
+        "reused": requests_sent - opened,
+        "requests": requests_sent,
+        "idle": idle,
+        "async_opened": _async_stats["opened"],
+        "async_reused": _async_stats["reused"],
+    }
@@ -0,0 +1,163 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm.metrics import calling_task, task_scope
+from llm.tokens import TOKENS_PER_REPLY, count_message_tokens
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+_logger = logging.getLogger(__name__)
+
+
+def summarize_turns(summary, turns, model="gpt-3.5-turbo"):
+    """
+    Folds conversation turns into the running summary of a conversation with the model.
+
+    Args:
+        summary (str | None): The previous summary, if any.
+        turns (list[dict]): The messages to add to the summary, oldest first.
+        model (str): (Optional) The model to use for summarizing. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        str: The updated summary.
+    """
+    from main import get_completion
+
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    prompt = f"""
+Update the summary of a conversation with the new messages below, delimited by triple backticks.
+Keep every fact needed to continue the conversation, like names, choices, quantities, sizes, prices and addresses.
+Answer with the updated summary only, in at most 120 words.
+
+Current summary: {summary or "(empty)"}
+
+New messages: ```{transcript}```
+"""
+    return get_completion(prompt, model=model)
+
+
+class ConversationMemory:
+    """
+    Conversation history whose prompt stays under a token budget, however long the conversation gets.
+
+    The pinned messages, like the system prompt, are always sent. The most recent turns are kept in a sliding window,
+    and the turns sliding out of it are either dropped or folded, in a background thread, into a compact summary
+    message sent after the pinned ones. When summarizing fails, the turns are kept as they are until the next one.
+    Token counts are updated incrementally on every change.
+
+    Args:
+        pinned (list[dict]): (Optional) The messages always sent first. Defaults to none.
+        max_tokens (int): (Optional) The prompt tokens budget. Defaults to 2048.
+        model (str): (Optional) The model the prompts are sent to. Defaults to "gpt-3.5-turbo".
+        summarize (bool): (Optional) Whether to summarize the turns leaving the window instead of dropping them.
+            Defaults to True.
+        summarizer (Callable[[str | None, list[dict]], str]): (Optional) Folds turns into the previous summary.
+            Defaults to `summarize_turns`.
+    """
+
+    def __init__(self, pinned=(), max_tokens=2048, model="gpt-3.5-turbo", summarize=True, summarizer=None):
+        self.pinned = list(pinned)
+        self.max_tokens = max_tokens
+        self.model = model
+        self.summarize = summarize
+        self.summarizer = summarizer or (lambda summary, turns: summarize_turns(summary, turns, model))
+        self.summary = None
+        self.window = []
+        self._window_tokens = []
+        self._pinned_tokens = sum(count_message_tokens(message, model) for message in self.pinned)
+        self._summary_tokens = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._executor = None
+        self._summarizing = None
+        self._summarizing_active = False
+
+    @property
+    def tokens(self):
+        """
+        int: The prompt tokens of the messages currently returned by `messages`.
+        """
+        return self._pinned_tokens + self._summary_tokens + sum(self._window_tokens) + TOKENS_PER_REPLY
+
+    def append(self, message):
+        """
+        Adds a message at the end of the conversation, sliding the oldest turns out of the window when the budget
+        is exceeded.
+
+        Args:
+            message (dict): The message, with a "role" and a "content".
+        """
+        with self._lock:
+            self.window.append(message)
+            self._window_tokens.append(count_message_tokens(message, self.model))
+            evicted = self._trim()
+            if evicted and self.summarize:
+                self._pending.extend(evicted)
+                if not self._summarizing_active:
+                    self._summarizing_active = True
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+                    # The task is found from the caller's stack, the summary thread only has the memory frames
+                    self._summarizing = self._executor.submit(self._summarize_pending, calling_task())
+
+    def _trim(self):
+        evicted = []
+        # The latest message always stays, even when it doesn't fit on its own
+        while self.tokens > self.max_tokens and len(self.window) > 1:
+            evicted.append(self.window.pop(0))
+            self._window_tokens.pop(0)
+        return evicted
+
+    def _summarize_pending(self, task):
+        with task_scope(task):
+            self._summarize_loop()
+
+    def _summarize_loop(self):
+        while True:
+            with self._lock:
+                turns, self._pending = self._pending, []
+                summary = self.summary
+                if not turns:
+                    self._summarizing_active = False
+                    return
+            try:
+                summary = self.summarizer(summary, turns)
+            except Exception:
+                _logger.warning("Summarizing the conversation failed, keeping the turns as they are", exc_info=True)
+                with self._lock:
+                    # The turns go back in the window as far as the budget allows, and the others are summarized
+                    # with the next turns leaving it
+                    turns += self._pending
+                    self.window[:0] = turns
+                    self._window_tokens[:0] = [count_message_tokens(turn, self.model) for turn in turns]
+                    self._pending = self._trim()
+                    self._summarizing_active = False
+                return
+            with self._lock:
+                self.summary = summary
+                self._summary_tokens = count_message_tokens(self._summary_message(), self.model)
+                # A longer summary can push the oldest turns out of the budget, they are folded in on the next loop
+                self._pending.extend(self._trim())
+
+    def _summary_message(self):
+        return {"role": "system", "content": SUMMARY_PREFIX + self.summary}
+
+    def messages(self):
+        """
+        Returns the messages to send to the model: the pinned ones, the summary if any, and the recent turns.
+
+        Returns:
+            list[dict]: The messages.
+        """
+        with self._lock:
+            summary = [self._summary_message()] if self.summary else []
+            return self.pinned + summary + list(self.window)
+
+    def wait(self):
+        """
+        Blocks until the turns that slid out of the window are folded into the summary.
+        """
+        summarizing = self._summarizing
+        if summarizing is not None:
+            summarizing.result()
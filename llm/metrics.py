@@ -0,0 +1,483 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_METRICS_PORT = 9464
+
+# Modules whose frames are skipped when looking for the task making a request
+_INFRASTRUCTURE_MODULES = (
+    "main",
+    "llm",
+    "openai",
+    "asyncio",
+    "concurrent",
+    "threading",
+    "contextlib",
+    "contextvars",
+    "functools",
+    "runpy",
+)
+
+_task = contextvars.ContextVar("llm_task", default=None)
+
+
+def calling_task():
+    """
+    Returns the task making the current request: the lesson module up the call stack, like "class_04_summarizing",
+    or the first module outside of the completion machinery.
+
+    Threads started by the completion functions inherit the task of their caller, see `task_scope`.
+
+    Returns:
+        str: The task label, "unknown" when there is none.
+    """
+    task = _task.get()
+    if task is not None:
+        return task
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("classes."):
+            return module.rpartition(".")[2]
+        if fallback is None and module.partition(".")[0] not in _INFRASTRUCTURE_MODULES:
+            fallback = module
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+@contextlib.contextmanager
+def task_scope(task=None):
+    """
+    Labels the requests made inside the context, including the ones made from the threads and tasks it starts
+    through `contextvars.copy_context()`, with a task.
+
+    Args:
+        task (str): (Optional) The task label. Defaults to None, the task of the caller, see `calling_task`.
+    """
+    token = _task.set(task or calling_task())
+    try:
+        yield
+    finally:
+        _task.reset(token)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter, one value per combination of labels.
+
+    Args:
+        name (str): The metric name.
+        description (str): The help text of the metric.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds to the counter.
+
+        Args:
+            amount (float): (Optional) The amount added. Defaults to 1.
+            **labels: The labels of the value.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+
+    def exposition(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, one per combination of labels.
+
+    Args:
+        name (str): The metric name.
+        description (str): The help text of the metric.
+        buckets (tuple[float]): (Optional) The upper bounds of the buckets. Defaults to `LATENCY_BUCKETS`.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records a value.
+
+        Args:
+            value (float): The observed value.
+            **labels: The labels of the value.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["count"] += 1
+            state["sum"] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "labels": dict(key),
+                    "buckets": dict(zip(self.buckets, state["counts"])),
+                    "count": state["count"],
+                    "sum": state["sum"],
+                }
+                for key, state in self.values.items()
+            ]
+
+    def exposition(self):
+        lines = []
+        with self._lock:
+            for key, state in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state['count']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {state['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {state['sum']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Set of counters and histograms, with the Prometheus text and JSON exports of their values.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, description, *args):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, description, *args)
+            return metric
+
+    def counter(self, name, description=""):
+        """
+        Returns the counter of a name, created on first use.
+
+        Args:
+            name (str): The metric name.
+            description (str): (Optional) The help text of the metric. Defaults to none.
+
+        Returns:
+            Counter: The counter.
+        """
+        return self._get(Counter, name, description)
+
+    def histogram(self, name, description="", buckets=LATENCY_BUCKETS):
+        """
+        Returns the histogram of a name, created on first use.
+
+        Args:
+            name (str): The metric name.
+            description (str): (Optional) The help text of the metric. Defaults to none.
+            buckets (tuple[float]): (Optional) The upper bounds of the buckets. Defaults to `LATENCY_BUCKETS`.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        return self._get(Histogram, name, description, buckets)
+
+    def snapshot(self):
+        """
+        Returns the current values of every metric.
+
+        Returns:
+            dict: The type, help text and values of each metric by name.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: {"type": metric.kind, "help": metric.description, "values": metric.snapshot()}
+            for metric in metrics
+        }
+
+    def to_prometheus(self):
+        """
+        Returns the current values of every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Removes every metric.
+        """
+        with self._lock:
+            self.metrics = {}
+
+
+_registry = MetricsRegistry()
+_hooks = []
+
+
+def get_metrics():
+    """
+    Returns the registry the completion functions record their metrics in.
+
+    Returns:
+        MetricsRegistry: The registry.
+    """
+    return _registry
+
+
+def add_hook(hook):
+    """
+    Registers a function called with every completion event, besides the built-in metrics.
+
+    Args:
+        hook (Callable[[str, dict], None]): Called with the event name, one of "request", "retry" and "cache", and
+            its fields.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregisters a function registered with `add_hook`.
+
+    Args:
+        hook (Callable[[str, dict], None]): The function.
+    """
+    _hooks.remove(hook)
+
+
+def _emit(event, fields):
+    for hook in list(_hooks):
+        hook(event, fields)
+
+
+def record_request(model, task, duration, outcome="ok", prompt_tokens=None, completion_tokens=None):
+    """
+    Records a request sent to the API.
+
+    Args:
+        model (str): The model of the request.
+        task (str): The task making the request.
+        duration (float): The seconds until the response, or the error.
+        outcome (str): (Optional) "ok", or the name of the error. Defaults to "ok".
+        prompt_tokens (int): (Optional) The prompt tokens billed. Defaults to None, unknown.
+        completion_tokens (int): (Optional) The completion tokens billed. Defaults to None, unknown.
+    """
+    _registry.counter("llm_requests_total", "Requests sent to the API").inc(model=model, task=task, outcome=outcome)
+    _registry.histogram("llm_request_duration_seconds", "Latency of the requests").observe(
+        duration, model=model, task=task
+    )
+    if prompt_tokens is not None:
+        _registry.counter("llm_prompt_tokens_total", "Prompt tokens sent").inc(prompt_tokens, model=model, task=task)
+    if completion_tokens is not None:
+        _registry.counter("llm_completion_tokens_total", "Completion tokens received").inc(
+            completion_tokens, model=model, task=task
+        )
+    if _hooks:
+        _emit(
+            "request",
+            {
+                "model": model,
+                "task": task,
+                "duration": duration,
+                "outcome": outcome,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            },
+        )
+
+
+def record_retry(model, task, reason):
+    """
+    Records a request sent again after an error.
+
+    Args:
+        model (str): The model of the request.
+        task (str): The task making the request.
+        reason (str): The name of the error.
+    """
+    _registry.counter("llm_retries_total", "Requests sent again after an error").inc(
+        model=model, task=task, reason=reason
+    )
+    if _hooks:
+        _emit("retry", {"model": model, "task": task, "reason": reason})
+
+
+def record_cache(model, task, hit):
+    """
+    Records a response cache lookup.
+
+    Args:
+        model (str): The model of the request.
+        task (str): The task making the request.
+        hit (bool): Whether the response was cached.
+    """
+    _registry.counter("llm_cache_lookups_total", "Response cache lookups").inc(
+        model=model, task=task, result="hit" if hit else "miss"
+    )
+    if _hooks:
+        _emit("cache", {"model": model, "task": task, "hit": hit})
+
+
+def serve_prometheus(port=DEFAULT_METRICS_PORT, host="127.0.0.1", registry=None):
+    """
+    Serves the metrics in the Prometheus text format on `/metrics`, from a background thread.
+
+    Args:
+        port (int): (Optional) The port to listen on. Defaults to `DEFAULT_METRICS_PORT`.
+        host (str): (Optional) The interface to listen on. Defaults to "127.0.0.1".
+        registry (MetricsRegistry): (Optional) The metrics served. Defaults to the completion functions ones.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server, stopped with `shutdown()`.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    registry = registry or _registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class JsonDumper:
+    """
+    Writes the metrics to a JSON file every `interval` seconds, from a background thread, and once more when stopped.
+
+    Args:
+        path (str): The file the metrics are written to.
+        interval (float): (Optional) The seconds between two dumps. Defaults to 60.
+        registry (MetricsRegistry): (Optional) The metrics written. Defaults to the completion functions ones.
+    """
+
+    def __init__(self, path, interval=60.0, registry=None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry or _registry
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def dump(self):
+        """
+        Writes the metrics now, replacing the file atomically.
+        """
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({"time": time.time(), "metrics": self.registry.snapshot()}, file, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.dump()
+
+    def start(self):
+        """
+        Starts dumping periodically.
+
+        Returns:
+            JsonDumper: The dumper itself.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops dumping, after writing the metrics a last time.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
+
+
+def start_exporters():
+    """
+    Starts the exporters configured with the `LLM_METRICS_PORT` (Prometheus text format) and `LLM_METRICS_JSON`
+    (periodic JSON dumps, every `LLM_METRICS_JSON_INTERVAL` seconds) environment variables.
+
+    Returns:
+        list: The started Prometheus server and JSON dumper.
+    """
+    exporters = []
+    if os.getenv("LLM_METRICS_PORT"):
+        exporters.append(serve_prometheus(int(os.getenv("LLM_METRICS_PORT"))))
+    if os.getenv("LLM_METRICS_JSON"):
+        interval = float(os.getenv("LLM_METRICS_JSON_INTERVAL", 60))
+        dumper = JsonDumper(os.getenv("LLM_METRICS_JSON"), interval).start()
+        atexit.register(dumper.stop)
+        exporters.append(dumper)
+    return exporters
@@ -0,0 +1,399 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = (
+    "the product arrived quickly and works well although the price seems a bit high for its size "
+    "customers appreciate the friendly support team and the sturdy design of this item overall"
+).split()
+_TOPICS_PATTERN = re.compile(r"List of topics: (.+)")
+_FIELD_PATTERN = re.compile(r'^- "(\w+)" \(([a-z ]+)(?:, one of: (.+?))?\)', re.MULTILINE)
+_FIELD_VALUES = {"boolean": False, "integer": 0, "number": 0.0}
+_ITEM_PATTERN = re.compile(r"<item (\d+)>(.*?)</item \1>", re.DOTALL)
+_JSON_KEYS_PATTERN = re.compile(r"JSON (?:format|object) with the (?:following )?keys:\s*([\w ,]+?)\s*\.")
+_JSON_COUNT_PATTERN = re.compile(r"\ba list of (\d+|two|three|four|five)\b")
+_CHOICE_PATTERN = re.compile(r'single word, either "(\w+)" or "(\w+)"')
+# Words making the mock answer the second choice of a single word question, like "negative"
+_NEGATIVE_CUES = re.compile(
+    r"\b(not|never|broke|broken|bad|poor|disappointed|disappointing|worse|worst|return|refund)\b"
+)
+_NUMBERS = {"two": 2, "three": 3, "four": 4, "five": 5}
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution, one of "constant:SECONDS", "uniform:LOW,HIGH", "normal:MEAN,STDDEV" or
+    "lognormal:MEDIAN,SIGMA".
+
+    Args:
+        spec (str): The distribution.
+
+    Returns:
+        Callable[[random.Random], float]: A function drawing a latency in seconds from the distribution.
+    """
+    name, _, arguments = spec.partition(":")
+    values = [float(value) for value in arguments.split(",")] if arguments else []
+    if name == "constant":
+        return lambda rng: values[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.normalvariate(values[0], values[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _json_object(keys, number, rng):
+    record = {}
+    for key in keys:
+        if key.endswith("_id") or key.startswith("num"):
+            record[key] = number
+        elif "price" in key:
+            record[key] = round(rng.uniform(1, 20), 2)
+        elif key.endswith("s"):
+            record[key] = rng.sample(_WORDS, 2)
+        else:
+            record[key] = " ".join(rng.sample(_WORDS, 3))
+    return record
+
+
+def default_responder(messages):
+    """
+    Builds a plausible completion for the messages of a request.
+
+    The answers are deterministic for the same messages, and follow the formats the lessons parse, like the
+    "topic: 0 or 1" lines of the news alerts prompt, the JSON objects of the prompts listing their keys, or the
+    numbered outputs of the packed prompts.
+
+    Args:
+        messages (list[dict]): The messages of the request.
+
+    Returns:
+        str: The completion.
+    """
+    prompt = messages[-1]["content"]
+    topics = _TOPICS_PATTERN.search(prompt)
+    if topics:
+        return "\n".join(f"{topic.strip()}: {i % 2}" for i, topic in enumerate(topics.group(1).split(",")))
+
+    items = _ITEM_PATTERN.findall(prompt)
+    if items:
+        instructions = prompt[: prompt.index("<item ")]
+        return "\n".join(
+            f"<output {number}>{default_responder([{'role': 'user', 'content': instructions + item}])}</output {number}>"
+            for number, item in items
+        )
+
+    choice = _CHOICE_PATTERN.search(prompt)
+    if choice:
+        return choice.group(2 if _NEGATIVE_CUES.search(prompt[choice.end() :].lower()) else 1).capitalize()
+
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    keys = _JSON_KEYS_PATTERN.search(prompt)
+    if keys:
+        count = _JSON_COUNT_PATTERN.search(prompt)
+        objects = [_json_object(keys.group(1).replace(" ", "").split(","), number, rng) for number in range(1, 6)]
+        if count is None:
+            return json.dumps(objects[0], indent=4)
+        return json.dumps(objects[: _NUMBERS.get(count.group(1)) or int(count.group(1))], indent=4)
+
+    fields = _FIELD_PATTERN.findall(prompt)
+    if fields:
+        record = {}
+        for name, kind, choices in fields:
+            if choices:
+                record[name] = json.loads(f"[{choices}]")[0]
+            elif kind == "list of strings":
+                record[name] = rng.sample(_WORDS, 3)
+            else:
+                record[name] = _FIELD_VALUES.get(kind, rng.choice(_WORDS))
+        return json.dumps(record)
+
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(12, 40))).capitalize() + "."
+
+
+class _RateWindow:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def admit(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.started_at >= 60:
+                self.started_at, self.requests, self.tokens = now, 0, 0
+            admitted = (self.requests_per_minute is None or self.requests < self.requests_per_minute) and (
+                self.tokens_per_minute is None or self.tokens + tokens <= self.tokens_per_minute
+            )
+            if admitted:
+                self.requests += 1
+                self.tokens += tokens
+            return admitted, self.headers(now)
+
+    def headers(self, now):
+        reset = f"{max(0.0, 60 - (now - self.started_at)):.3f}s"
+        headers = {}
+        if self.requests_per_minute is not None:
+            headers["x-ratelimit-limit-requests"] = str(self.requests_per_minute)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, self.requests_per_minute - self.requests))
+            headers["x-ratelimit-reset-requests"] = reset
+        if self.tokens_per_minute is not None:
+            headers["x-ratelimit-limit-tokens"] = str(self.tokens_per_minute)
+            headers["x-ratelimit-remaining-tokens"] = str(max(0, self.tokens_per_minute - self.tokens))
+            headers["x-ratelimit-reset-tokens"] = reset
+        return headers
+
+
+class MockServer:
+    """
+    Local stand-in for the chat completions endpoint of the OpenAI API, answering with the same response shape.
+
+    Point the openai library at it by setting `openai.api_base` (or the `OPENAI_API_BASE` environment variable) to
+    `server.api_base`.
+
+    Args:
+        host (str): (Optional) The interface to listen on. Defaults to "127.0.0.1".
+        port (int): (Optional) The port to listen on. Defaults to 0, any free port.
+        latency (str): (Optional) The latency distribution before the first byte, see `parse_latency`.
+            Defaults to "constant:0".
+        token_latency (float): (Optional) The seconds between two streamed chunks. Defaults to 0.
+        error_rate (float): (Optional) The fraction of requests answered with a server error. Defaults to 0.
+        requests_per_minute (int): (Optional) The requests limit enforced with 429 errors. Defaults to None.
+        tokens_per_minute (int): (Optional) The tokens limit enforced with 429 errors. Defaults to None.
+        responder (Callable[[list[dict]], str]): (Optional) Builds the completion of the request messages.
+            Defaults to `default_responder`.
+        seed (int): (Optional) The seed of the latency and error draws. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency="constant:0",
+        token_latency=0.0,
+        error_rate=0.0,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        responder=default_responder,
+        seed=None,
+    ):
+        self.latency = parse_latency(latency)
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.responder = responder
+        self.rate_window = _RateWindow(requests_per_minute, tokens_per_minute)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cancelled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            return self.latency(self._rng), self._rng.random() < self.error_rate
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # The headers and the body are separate writes, which Nagle's algorithm and the delayed ACK of the client
+            # would hold for about 40 ms on every keep-alive request
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_one_request(self):
+                try:
+                    super().handle_one_request()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed a keep-alive connection, like a hedged request losing or a closed pool
+                    self.close_connection = True
+
+            def _send_json(self, status, body, headers):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}}, {})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                try:
+                    server._handle(self, request)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away, after a timeout or to stop a stream, which cancels the generation
+                    with server._lock:
+                        server.cancelled += 1
+                    self.close_connection = True
+
+        return Handler
+
+    def _handle(self, handler, request):
+        messages = request["messages"]
+        prompt_tokens = sum(_count_tokens(message["content"]) + 4 for message in messages) + 3
+        latency, failed = self._draw()
+
+        admitted, headers = self.rate_window.admit(prompt_tokens + request.get("max_tokens", 0))
+        if not admitted:
+            with self._lock:
+                self.rate_limited += 1
+            error = {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}
+            handler._send_json(429, {"error": error}, headers)
+            return
+
+        time.sleep(latency)
+        if failed:
+            with self._lock:
+                self.errors += 1
+            error = {"message": "The server had an error while processing your request.", "type": "server_error"}
+            handler._send_json(500, {"error": error}, headers)
+            return
+
+        n = request.get("n", 1)
+        # The samples of a random request differ, the prompt of each one is changed by trailing newlines
+        variants = range(n) if request.get("temperature", 1) > 0 else [0] * n
+        contents = [
+            self.responder(messages[:-1] + [{**messages[-1], "content": messages[-1]["content"] + "\n" * variant}])
+            for variant in variants
+        ]
+        completion_id = f"chatcmpl-mock{self.requests}"
+        if request.get("stream"):
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Transfer-Encoding", "chunked")
+            for name, value in headers.items():
+                handler.send_header(name, value)
+            handler.end_headers()
+            for index, content in enumerate(contents):
+                for word in re.findall(r"\S+\s*", content):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [{"index": index, "delta": {"content": word}, "finish_reason": None}],
+                    }
+                    handler._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    time.sleep(self.token_latency)
+            handler._send_chunk(b"data: [DONE]\n\n")
+            handler._send_chunk(b"")
+            return
+
+        completion_tokens = sum(_count_tokens(content) for content in contents)
+        body = {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [
+                {"index": index, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for index, content in enumerate(contents)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        handler._send_json(200, body, headers)
+
+    def start(self):
+        """
+        Starts serving from a background thread.
+
+        Returns:
+            MockServer: The server itself.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serves from the current thread until interrupted.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        """
+        Stops serving and closes the listening socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="constant:0", help='e.g. "lognormal:0.5,0.4"')
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute limit")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        token_latency=args.token_latency,
+        error_rate=args.error_rate,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        seed=args.seed,
+    )
+    print(f"Serving the mock chat completions API on {server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
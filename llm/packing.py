@@ -0,0 +1,189 @@
+import re
+import threading
+
+from llm.templates import PromptTemplate
+from llm.tokens import count_tokens
+
+DEFAULT_PACK_TOKENS = 1000
+DEFAULT_PACK_ITEMS = 10
+
+PACKED_PROMPT = PromptTemplate(
+    """
+    {instructions}
+
+    Apply the instructions above to each of the {count} items below, separately. Each item is delimited by \
+    <item N> and </item N> tags, where N is its number. Answer with the output of each item, in order, delimited \
+    by <output N> and </output N> tags with the number of the item, and nothing else.
+
+    {items}
+    """
+)
+SINGLE_PROMPT = PromptTemplate(
+    """
+    {instructions}
+    ```{item}```
+    """
+)
+
+_OUTPUT_PATTERN = re.compile(r"<output (\d+)>(.*?)</output \1>", re.DOTALL)
+
+_stats_lock = threading.Lock()
+_stats = {"items": 0, "requests": 0, "retried": 0, "prompt_tokens": 0, "unpacked_prompt_tokens": 0}
+
+
+def _record(**counts):
+    with _stats_lock:
+        for name, count in counts.items():
+            _stats[name] += count
+
+
+def packing_stats():
+    """
+    Returns the counters of the packed requests, to measure the requests and tokens saved by packing.
+
+    Returns:
+        dict: The items completed, the requests sent for them (packs and individual retries), the items retried
+        individually, the prompt tokens sent, the prompt tokens one request per item would have sent, and the requests
+        and prompt tokens saved.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["requests_saved"] = stats["items"] - stats["requests"]
+    stats["tokens_saved"] = stats["unpacked_prompt_tokens"] - stats["prompt_tokens"]
+    return stats
+
+
+def single_prompt(instructions, item):
+    """
+    Builds the prompt applying the instructions to a single item.
+
+    Args:
+        instructions (str): The instructions shared by every item.
+        item (str): The item.
+
+    Returns:
+        str: The prompt.
+    """
+    return SINGLE_PROMPT.render(instructions=instructions, item=item)
+
+
+def pack_prompt(instructions, items):
+    """
+    Builds the prompt applying the instructions to several items at once, numbered from 1.
+
+    Args:
+        instructions (str): The instructions shared by every item.
+        items (list[str]): The items.
+
+    Returns:
+        str: The prompt.
+    """
+    delimited = "\n".join(f"<item {number}>{item}</item {number}>" for number, item in enumerate(items, start=1))
+    return PACKED_PROMPT.render(instructions=instructions, count=len(items), items=delimited)
+
+
+def parse_outputs(response, count):
+    """
+    Splits the answer to a packed prompt into the outputs of its items.
+
+    Args:
+        response (str): The model answer.
+        count (int): The number of items in the prompt.
+
+    Returns:
+        list[str | None]: The output of each item, None for the items without a matching output.
+    """
+    outputs = [None] * count
+    for number, output in _OUTPUT_PATTERN.findall(response):
+        index = int(number) - 1
+        if 0 <= index < count and outputs[index] is None:
+            outputs[index] = output.strip()
+    return outputs
+
+
+def pack_items(items, max_tokens=DEFAULT_PACK_TOKENS, max_items=DEFAULT_PACK_ITEMS, model="gpt-3.5-turbo"):
+    """
+    Groups consecutive items so that the items of each group stay under a token budget.
+
+    Args:
+        items (list[str]): The items.
+        max_tokens (int): (Optional) The item tokens of a group. Defaults to `DEFAULT_PACK_TOKENS`.
+        max_items (int): (Optional) The items of a group. Defaults to `DEFAULT_PACK_ITEMS`.
+        model (str): (Optional) The model whose tokenizer is used. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        list[list[int]]: The indexes of the items of each group. An item over the budget is alone in its group.
+    """
+    packs, pack, pack_tokens = [], [], 0
+    for index, item in enumerate(items):
+        tokens = count_tokens(item, model)
+        if pack and (pack_tokens + tokens > max_tokens or len(pack) >= max_items):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append(index)
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def complete_packed(
+    instructions,
+    items,
+    model="gpt-3.5-turbo",
+    temperature=0,
+    max_tokens=DEFAULT_PACK_TOKENS,
+    max_items=DEFAULT_PACK_ITEMS,
+    max_workers=16,
+    use_cache=None,
+):
+    """
+    Applies the same instructions to many small items, sending several items in each request instead of one request
+    per item, so the instructions are sent once per group.
+
+    The items whose output can't be found in the answer are requested again, one by one.
+
+    Args:
+        instructions (str): The instructions shared by every item.
+        items (list[str]): The items.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        max_tokens (int): (Optional) The item tokens of a request. Defaults to `DEFAULT_PACK_TOKENS`.
+        max_items (int): (Optional) The items of a request. Defaults to `DEFAULT_PACK_ITEMS`.
+        max_workers (int): (Optional) The maximum number of requests in flight at once. Defaults to 16.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+
+    Returns:
+        list[str]: The output of each item, in the same order as the items.
+    """
+    from main import get_completions
+
+    def complete(prompts):
+        _record(requests=len(prompts), prompt_tokens=sum(count_tokens(prompt, model) for prompt in prompts))
+        return get_completions(
+            prompts, model=model, temperature=temperature, max_workers=max_workers, use_cache=use_cache
+        )
+
+    packs = pack_items(items, max_tokens, max_items, model)
+    prompts = [
+        single_prompt(instructions, items[pack[0]])
+        if len(pack) == 1
+        else pack_prompt(instructions, [items[i] for i in pack])
+        for pack in packs
+    ]
+    outputs = [None] * len(items)
+    for pack, response in zip(packs, complete(prompts)):
+        pack_outputs = [response] if len(pack) == 1 else parse_outputs(response, len(pack))
+        for index, output in zip(pack, pack_outputs):
+            outputs[index] = output
+
+    missing = [index for index, output in enumerate(outputs) if output is None]
+    if missing:
+        for index, output in zip(missing, complete([single_prompt(instructions, items[i]) for i in missing])):
+            outputs[index] = output
+    _record(
+        items=len(items),
+        retried=len(missing),
+        unpacked_prompt_tokens=sum(count_tokens(single_prompt(instructions, item), model) for item in items),
+    )
+    return outputs
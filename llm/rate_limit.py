@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import time
+
+from llm.tokens import count_messages_tokens
+
+DEFAULT_REQUESTS_PER_MINUTE = 3500
+DEFAULT_TOKENS_PER_MINUTE = 90000
+# Tokens reserved for the completion when the request does not say how long it may be
+DEFAULT_COMPLETION_TOKENS = 256
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """
+    Parses a duration as sent in the rate limit headers, like "20ms", "1s" or "6m0s".
+
+    Args:
+        value (str): The duration to parse.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_PATTERN.findall(value))
+
+
+def estimate_tokens(messages, max_tokens=None, model="gpt-3.5-turbo", n=1):
+    """
+    Estimates the tokens a request consumes from the tokens per minute budget.
+
+    Args:
+        messages (list[dict]): The messages sent to the model.
+        max_tokens (int): (Optional) The completion length limit of the request. Defaults to None.
+        model (str): (Optional) The model of the request. Defaults to "gpt-3.5-turbo".
+        n (int): (Optional) The completions generated for the prompt. Defaults to 1.
+
+    Returns:
+        int: The prompt tokens plus the completion allowance of each completion.
+    """
+    prompt_tokens = count_messages_tokens(messages, model)
+    return prompt_tokens + n * (max_tokens if max_tokens is not None else DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity every `period` seconds.
+
+    Args:
+        capacity (float): The maximum amount the bucket holds, and the amount refilled every period.
+        period (float): (Optional) The seconds it takes to refill an empty bucket. Defaults to 60.
+    """
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.period = period
+        self.level = capacity
+        self._updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated_at) * self.capacity / self.period)
+        self._updated_at = now
+
+    def wait_time(self, amount):
+        # A request bigger than the whole bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * self.period / self.capacity
+
+    def consume(self, amount):
+        self.level -= amount
+
+    def sync(self, remaining=None, limit=None):
+        if limit is not None and limit > 0:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Keeps the requests and the estimated tokens sent to the API under the account limits, using one token bucket
+    for each of them. Callers wait for their turn instead of getting rate limit errors.
+
+    Args:
+        requests_per_minute (int): (Optional) The requests budget. Defaults to 3500.
+        tokens_per_minute (int): (Optional) The tokens budget. Defaults to 90000.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.acquired_requests = 0
+        self.acquired_tokens = 0
+        self.waited_seconds = 0.0
+        self.rate_limited = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self._paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.acquired_requests += 1
+            self.acquired_tokens += tokens
+            return 0.0
+
+    def acquire(self, tokens):
+        """
+        Blocks until a request of `tokens` estimated tokens fits in both budgets, and consumes them.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self.waited_seconds += wait
+            time.sleep(wait)
+
+    def try_acquire(self, tokens):
+        """
+        Consumes the budget of a request only when it fits in both budgets right away, without waiting.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+
+        Returns:
+            bool: Whether the budget was consumed.
+        """
+        return self._reserve(tokens) <= 0
+
+    async def aacquire(self, tokens):
+        """
+        Asynchronous counterpart of `acquire`.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+        """
+        import asyncio  # already loaded by the running event loop, left out of the module imports for start up time
+
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """
+        Resynchronizes the buckets with the "x-ratelimit-*" headers of an API response.
+
+        Args:
+            headers (Mapping[str, str]): The response headers.
+        """
+        if not headers or "x-ratelimit-remaining-requests" not in headers:
+            return
+
+        def number(name):
+            value = headers.get(name)
+            return float(value) if value is not None else None
+
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.sync(number("x-ratelimit-remaining-requests"), number("x-ratelimit-limit-requests"))
+            self.tokens.sync(number("x-ratelimit-remaining-tokens"), number("x-ratelimit-limit-tokens"))
+
+    def on_rate_limited(self, headers):
+        """
+        Pauses every request after the API answered with a rate limit error, until the budget is expected to reset.
+
+        Args:
+            headers (Mapping[str, str]): The error response headers.
+        """
+        headers = headers or {}
+        self.update_from_headers(headers)
+        try:
+            delay = float(headers["retry-after"])
+        except (KeyError, ValueError):
+            resets = [
+                headers[name] for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens") if name in headers
+            ]
+            # The earliest reset is enough, the buckets were already resynchronized with the remaining budgets
+            delay = min((parse_duration(reset) for reset in resets), default=1.0)
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def stats(self):
+        """
+        Returns the limiter counters.
+
+        Returns:
+            dict: The acquired requests and tokens, the seconds spent waiting and the rate limit errors received.
+        """
+        return {
+            "requests": self.acquired_requests,
+            "tokens": self.acquired_tokens,
+            "waited_seconds": self.waited_seconds,
+            "rate_limited": self.rate_limited,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the rate limiter used by the completion functions, created on first use.
+
+    The `OPENAI_REQUESTS_PER_MINUTE` and `OPENAI_TOKENS_PER_MINUTE` environment variables set its initial budgets,
+    which are then adjusted with the limits reported by the API.
+
+    Returns:
+        RateLimiter: The active rate limiter.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+                int(os.getenv("OPENAI_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+            )
+    return _limiter
+
+
+def set_rate_limiter(limiter):
+    """
+    Replaces the rate limiter used by the completion functions.
+
+    Args:
+        limiter (RateLimiter): The new rate limiter.
+    """
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+
+def response_hook(response, *args, **kwargs):
+    """
+    `requests` response hook that feeds the rate limit headers of every API response to the rate limiter.
+    """
+    get_rate_limiter().update_from_headers(response.headers)
@@ -0,0 +1,67 @@
+import ast
+import json
+import os
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LESSONS_DIR = os.path.join(ROOT_DIR, "classes")
+INDEX_PATH = os.path.join(ROOT_DIR, ".lessons_index.json")
+
+
+def _has_execute(path):
+    with open(path, "rb") as file:
+        tree = ast.parse(file.read(), filename=path)
+    return any(
+        isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "execute" for node in tree.body
+    )
+
+
+def _load_index(index_path):
+    try:
+        with open(index_path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def find_lessons(lessons_dir=LESSONS_DIR, index_path=INDEX_PATH):
+    """
+    Finds the lesson scripts and whether they define an `execute` entry point, without importing them.
+
+    The scripts are parsed statically and the result is kept in an index file, so only the scripts added or modified
+    since the last run are parsed again.
+
+    Args:
+        lessons_dir (str): (Optional) The directory of the lesson scripts. Defaults to the `classes` directory.
+        index_path (str): (Optional) The index file. Defaults to `.lessons_index.json` in the repository root.
+
+    Returns:
+        list[dict]: The lessons sorted by file name, each one with its "module" name, its display "name" and whether
+        it "has_execute".
+    """
+    index = _load_index(index_path)
+    updated_index = {}
+    lessons = []
+    with os.scandir(lessons_dir) as entries:
+        scripts = sorted((entry for entry in entries if entry.name.endswith(".py")), key=lambda entry: entry.name)
+
+    for entry in scripts:
+        stat = entry.stat()
+        cached = index.get(entry.name)
+        if cached is not None and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+            has_execute = cached["has_execute"]
+        else:
+            has_execute = _has_execute(entry.path)
+        updated_index[entry.name] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "has_execute": has_execute}
+
+        module_name = os.path.splitext(entry.name)[0]
+        lessons.append(
+            {"module": module_name, "name": module_name.replace("_", " ").title(), "has_execute": has_execute}
+        )
+
+    if updated_index != index:
+        try:
+            with open(index_path, "w", encoding="utf-8") as file:
+                json.dump(updated_index, file)
+        except OSError:
+            pass  # a read-only checkout still works, it just parses the scripts every time
+    return lessons
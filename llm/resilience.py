@@ -0,0 +1,330 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+
+DEFAULT_REQUEST_TIMEOUT = 60.0
+# Seconds all the attempts of a request, and the backoff delays between them, may take together
+DEFAULT_TOTAL_TIMEOUT = 120.0
+# Times a request failing with a transient error is sent again before giving up
+MAX_RETRIES = 4
+# Full jitter exponential backoff between the retries: a random delay up to base * 2 ** attempt, capped
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+DEFAULT_HEDGE_MAX_LOAD = 0.1
+
+
+def request_timeout(timeout=None):
+    """
+    Returns the deadline of a request, in seconds.
+
+    Args:
+        timeout (float): (Optional) The deadline asked by the caller. Defaults to None, the `OPENAI_REQUEST_TIMEOUT`
+            environment variable or `DEFAULT_REQUEST_TIMEOUT`.
+
+    Returns:
+        float: The deadline.
+    """
+    if timeout is not None:
+        return timeout
+    return float(os.getenv("OPENAI_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT))
+
+
+def total_timeout(timeout=None):
+    """
+    Returns the deadline of all the attempts of a request together, in seconds, which is never shorter than the
+    deadline of a single attempt.
+
+    Args:
+        timeout (float): (Optional) The deadline of each attempt asked by the caller. Defaults to None, see
+            `request_timeout`.
+
+    Returns:
+        float: The `OPENAI_TOTAL_TIMEOUT` environment variable or `DEFAULT_TOTAL_TIMEOUT`, at least the deadline of
+        an attempt.
+    """
+    return max(float(os.getenv("OPENAI_TOTAL_TIMEOUT", DEFAULT_TOTAL_TIMEOUT)), request_timeout(timeout))
+
+
+def _run_in_thread(function):
+    from concurrent.futures import Future
+
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(function))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return future
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX, rng=random):
+    """
+    Returns the delay before retrying a failed request, drawn with full jitter so that the clients failing together
+    don't retry together.
+
+    Args:
+        attempt (int): The number of retries already made.
+        base (float): (Optional) The maximum delay of the first retry. Defaults to `BACKOFF_BASE`.
+        cap (float): (Optional) The maximum delay of any retry. Defaults to `BACKOFF_MAX`.
+        rng (random.Random): (Optional) The random generator. Defaults to the `random` module.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return rng.uniform(0, min(cap, base * 2**attempt))
+
+
+def is_retryable(error):
+    """
+    Tells whether a request error is transient, so the same request may succeed when it is sent again.
+
+    Args:
+        error (Exception): The error raised by `openai.ChatCompletion.create` or `acreate`.
+
+    Returns:
+        bool: True for timeouts, connection errors and server errors.
+    """
+    from openai import error as openai_error
+
+    transient = (
+        openai_error.Timeout,
+        openai_error.APIConnectionError,
+        openai_error.ServiceUnavailableError,
+        openai_error.TryAgain,
+        TimeoutError,
+    )
+    if isinstance(error, transient):
+        return True
+    # Invalid requests, authentication and permission errors have their own types, and fail again the same way
+    if isinstance(error, openai_error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+class Hedger:
+    """
+    Sends a duplicate of the requests that take longer than most, and keeps whichever answer arrives first.
+
+    A request is duplicated once it has been waiting for longer than the `quantile` of the recent latencies, so only
+    the stragglers are, and the duplicates are capped to a fraction of the requests. It must only be used for
+    idempotent requests, like the temperature 0 ones.
+
+    Args:
+        max_extra_load (float): (Optional) The duplicates allowed, as a fraction of the requests. Defaults to 0.1.
+        quantile (float): (Optional) The quantile of the latencies after which a request is duplicated.
+            Defaults to 0.95.
+        min_samples (int): (Optional) The latencies needed before duplicating any request. Defaults to 20.
+        window (int): (Optional) The number of recent latencies kept. Defaults to 500.
+    """
+
+    def __init__(self, max_extra_load=DEFAULT_HEDGE_MAX_LOAD, quantile=0.95, min_samples=20, window=500):
+        self.max_extra_load = max_extra_load
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Records the latency of a request.
+
+        Args:
+            latency (float): The latency in seconds.
+        """
+        with self._lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """
+        Returns how long to wait for a request before duplicating it.
+
+        Returns:
+            float | None: The delay in seconds, None while there are too few latencies to tell the stragglers apart.
+        """
+        with self._lock:
+            if self.max_extra_load <= 0 or len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def _start(self):
+        with self._lock:
+            self.requests += 1
+
+    def _has_budget(self):
+        with self._lock:
+            return self.hedges + 1 <= self.max_extra_load * self.requests
+
+    def _allow_hedge(self, admit):
+        with self._lock:
+            if self.hedges + 1 > self.max_extra_load * self.requests:
+                return False
+            self.hedges += 1
+        # The duplicate is a request of its own for the account limits, it is only sent when they have room for it
+        if admit is not None and not admit():
+            with self._lock:
+                self.hedges -= 1
+            return False
+        return True
+
+    def _won(self, hedged):
+        if hedged:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def call(self, send, admit=None):
+        """
+        Sends a request, and a duplicate of it if it takes longer than the hedging delay.
+
+        The request is sent from the caller thread while no duplicate can be sent. Otherwise it is sent from a thread
+        of its own, started right away, so that the caller can return the duplicate answer, and the slower of the two
+        requests finishes in the background.
+
+        Args:
+            send (Callable[[], Any]): Sends the request and returns its response.
+            admit (Callable[[], bool]): (Optional) Called before sending the duplicate, which is only sent when it
+                returns True, like `RateLimiter.try_acquire`. Defaults to None, the duplicate is always sent.
+
+        Returns:
+            Any: The first successful response.
+
+        Raises:
+            Exception: The error of the first request, when both fail.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        self._start()
+        delay = self.delay()
+        started_at = time.perf_counter()
+        if delay is None or not self._has_budget():
+            response = send()
+            self.record(time.perf_counter() - started_at)
+            return response
+
+        primary = _run_in_thread(send)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._allow_hedge(admit):
+            response = primary.result()
+            self.record(time.perf_counter() - started_at)
+            return response
+
+        hedge = _run_in_thread(send)
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._won(future is hedge)
+                    self.record(time.perf_counter() - started_at)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def acall(self, send, admit=None):
+        """
+        Asynchronous counterpart of `call`. The slower of the two requests is cancelled.
+
+        Args:
+            send (Callable[[], Awaitable]): Sends the request and returns its response.
+            admit (Callable[[], bool]): (Optional) Called before sending the duplicate, which is only sent when it
+                returns True. Defaults to None, the duplicate is always sent.
+
+        Returns:
+            Any: The first successful response.
+
+        Raises:
+            Exception: The error of the first request, when both fail.
+        """
+        import asyncio
+
+        self._start()
+        delay = self.delay()
+        started_at = time.perf_counter()
+        if delay is None:
+            response = await send()
+            self.record(time.perf_counter() - started_at)
+            return response
+
+        primary = asyncio.ensure_future(send())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._allow_hedge(admit):
+            response = await primary
+            self.record(time.perf_counter() - started_at)
+            return response
+
+        hedge = asyncio.ensure_future(send())
+        pending, error = {primary, hedge}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._won(task is hedge)
+                        self.record(time.perf_counter() - started_at)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """
+        Returns the hedging counters.
+
+        Returns:
+            dict: The requests, the duplicates sent, the duplicates answering first, the extra load and the current
+            hedging delay in seconds.
+        """
+        delay = self.delay()
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "extra_load": self.hedges / self.requests if self.requests else 0.0,
+                "delay": delay,
+            }
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """
+    Returns the hedger used by the completion functions, created on first use.
+
+    The `OPENAI_HEDGE_MAX_LOAD` environment variable sets the duplicates allowed as a fraction of the requests, 0
+    disables hedging.
+
+    Returns:
+        Hedger: The active hedger.
+    """
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(float(os.getenv("OPENAI_HEDGE_MAX_LOAD", DEFAULT_HEDGE_MAX_LOAD)))
+    return _hedger
+
+
+def set_hedger(hedger):
+    """
+    Replaces the hedger used by the completion functions.
+
+    Args:
+        hedger (Hedger): The new hedger.
+    """
+    global _hedger
+    with _hedger_lock:
+        _hedger = hedger
@@ -0,0 +1,343 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from llm.templates import PromptTemplate, normalize_whitespace
+
+# The departments getting a summary of the reviews of each product, and the aspects they care about
+DEPARTMENTS = {
+    "Shipping": "shipping and delivery",
+    "Pricing": "the price and perceived value",
+}
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FAN_IN = 8
+
+MAP_INSTRUCTIONS = PromptTemplate(
+    """
+    Your task is to generate a short summary of a product \
+    review from an ecommerce site to give feedback to the \
+    {departments} departments.
+
+    Summarize the review below, delimited by triple \
+    backticks, in at most 30 words, and focusing on any aspects \
+    that are relevant to {aspects}.
+    """
+)
+REDUCE_PROMPT = PromptTemplate(
+    """
+    Your task is to combine the summaries of several reviews \
+    of a product from an ecommerce site into a single summary.
+
+    Combine the summaries below, delimited by triple \
+    backticks, into one summary of at most 60 words, keeping \
+    the aspects that are relevant to {aspects}, and how often \
+    they are mentioned.
+
+    Product: {product}
+    Summaries: ```{summaries}```
+    """
+)
+FOCUS_PROMPT = PromptTemplate(
+    """
+    Your task is to generate a short summary of the reviews \
+    of a product from an ecommerce site to give feedback to \
+    the {department} department.
+
+    From the summaries of the reviews below, delimited by \
+    triple backticks, summarize in at most 30 words the \
+    aspects that are relevant to {aspect}.
+
+    Product: {product}
+    Summaries: ```{summaries}```
+    """
+)
+
+
+def read_reviews(path, product_key="product", text_key="review"):
+    """
+    Streams the reviews of a JSONL or CSV file, one row at a time, whatever the size of the file.
+
+    Args:
+        path (str): The file, read as CSV when its extension is ".csv", and as JSON lines otherwise.
+        product_key (str): (Optional) The column, or member, identifying the product. Defaults to "product".
+        text_key (str): (Optional) The column, or member, with the review. Defaults to "review".
+
+    Yields:
+        tuple[str, str]: The product and the text of each review with some text.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for row in rows:
+            text = row.get(text_key)
+            if text:
+                yield str(row.get(product_key) or ""), normalize_whitespace(str(text))
+
+
+def _batches(reviews, size):
+    batch = []
+    for review in reviews:
+        batch.append(review)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ReviewSummarizer:
+    """
+    Map-reduce summarization of the reviews of many products, into a summary of each product for each department.
+
+    The reviews are read in batches, and each review is summarized with the aspects the departments care about,
+    several reviews per request (see `llm.packing`) and many requests in parallel. The summaries of each product are
+    then combined `fan_in` at a time, and the combined summaries again, like the levels of a tree, so the memory used
+    for a product grows with the logarithm of its reviews count. Finally, each department gets a summary of the
+    remaining combined summaries focused on its aspects.
+
+    The reviews of every product are grouped until the end. When they are sorted by product, each product can instead
+    be finished and forgotten as soon as its reviews end, so the summaries held don't grow with the number of
+    products, see `run`.
+
+    Args:
+        departments (dict[str, str]): (Optional) The aspects each department cares about. Defaults to `DEPARTMENTS`.
+        batch_size (int): (Optional) The reviews summarized together. Defaults to `DEFAULT_BATCH_SIZE`.
+        fan_in (int): (Optional) The summaries combined by each request. Defaults to `DEFAULT_FAN_IN`.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+        max_workers (int): (Optional) The maximum number of requests in flight at once. Defaults to 16.
+        progress (Callable[[dict], None]): (Optional) Called with the `stats` after each batch. Defaults to None.
+        dedup (NearDuplicateIndex): (Optional) The summaries of the previous reviews, reused for the near-duplicate
+            reviews, see `llm.dedup`. Defaults to None, every review is summarized.
+    """
+
+    def __init__(
+        self,
+        departments=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        fan_in=DEFAULT_FAN_IN,
+        model="gpt-3.5-turbo",
+        max_workers=16,
+        progress=None,
+        dedup=None,
+    ):
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+        self.departments = departments or DEPARTMENTS
+        self.batch_size = batch_size
+        self.fan_in = fan_in
+        self.model = model
+        self.max_workers = max_workers
+        self.progress = progress
+        self.dedup = dedup
+        self.aspects = ", ".join(self.departments.values())
+        self.map_instructions = MAP_INSTRUCTIONS.render(departments=", ".join(self.departments), aspects=self.aspects)
+        self.counts = {"reviews": 0, "products": 0, "map_requests": 0, "reduce_requests": 0, "focus_requests": 0}
+        self._levels = {}
+        self._started_at = None
+
+    def stats(self):
+        """
+        Returns the progress and the throughput of the pipeline.
+
+        Returns:
+            dict: The reviews read, the products summarized, the requests of each stage, the products in progress,
+            the summaries they hold, the seconds elapsed, the reviews summarized per second, and the hit rate of the
+            near-duplicate index when there is one.
+        """
+        elapsed = time.perf_counter() - self._started_at if self._started_at is not None else 0.0
+        dedup = {"dedup_hit_rate": self.dedup.stats()["hit_rate"]} if self.dedup is not None else {}
+        return {
+            **self.counts,
+            **dedup,
+            "open_products": len(self._levels),
+            "pending_summaries": sum(len(level) for levels in self._levels.values() for level in levels),
+            "elapsed": elapsed,
+            "reviews_per_second": self.counts["reviews"] / elapsed if elapsed else 0.0,
+        }
+
+    def _complete(self, prompts, stage):
+        from main import get_completions
+
+        # The prompts are sent `batch_size` at a time, so a stage never holds more than a batch of them in flight
+        completions = []
+        for start in range(0, len(prompts), self.batch_size):
+            chunk = prompts[start : start + self.batch_size]
+            self.counts[f"{stage}_requests"] += len(chunk)
+            completions.extend(get_completions(chunk, model=self.model, max_workers=self.max_workers))
+        return completions
+
+    def _map(self, batch):
+        from llm.packing import complete_packed, packing_stats
+
+        def summarize(texts):
+            return complete_packed(self.map_instructions, texts, model=self.model, max_workers=self.max_workers)
+
+        texts = [text for _, text in batch]
+        requests_before = packing_stats()["requests"]
+        summaries = summarize(texts) if self.dedup is None else self.dedup.dedupe(texts, summarize)
+        self.counts["map_requests"] += packing_stats()["requests"] - requests_before
+        return summaries
+
+    def _reduce_prompt(self, product, summaries):
+        return REDUCE_PROMPT.render(aspects=self.aspects, product=product, summaries="\n".join(summaries))
+
+    def _reduce_full_levels(self):
+        # Every level holding `fan_in` summaries is combined into one summary of the next level, until none is full
+        while True:
+            jobs = []
+            for product, levels in self._levels.items():
+                for depth, level in enumerate(levels):
+                    if len(level) >= self.fan_in:
+                        jobs.append((product, depth, level[: self.fan_in]))
+                        del level[: self.fan_in]
+            if not jobs:
+                return
+            prompts = [self._reduce_prompt(product, summaries) for product, _, summaries in jobs]
+            for (product, depth, _), summary in zip(jobs, self._complete(prompts, "reduce")):
+                levels = self._levels[product]
+                if depth + 1 == len(levels):
+                    levels.append([])
+                levels[depth + 1].append(summary)
+
+    def _finish(self, products):
+        # The summaries left in the levels of each product are combined until `fan_in` at most remain
+        remaining = {
+            product: [summary for level in self._levels.pop(product) for summary in level] for product in products
+        }
+        while True:
+            jobs = [
+                (product, summaries[start : start + self.fan_in])
+                for product, summaries in remaining.items()
+                if len(summaries) > self.fan_in
+                for start in range(0, len(summaries), self.fan_in)
+            ]
+            if not jobs:
+                break
+            for product in {product for product, _ in jobs}:
+                remaining[product] = []
+            prompts = [self._reduce_prompt(product, summaries) for product, summaries in jobs]
+            for (product, _), summary in zip(jobs, self._complete(prompts, "reduce")):
+                remaining[product].append(summary)
+
+        jobs = [(product, department) for product in remaining for department in self.departments]
+        prompts = [
+            FOCUS_PROMPT.render(
+                department=department,
+                aspect=self.departments[department],
+                product=product,
+                summaries="\n".join(remaining[product]),
+            )
+            for product, department in jobs
+        ]
+        results = {product: {} for product in remaining}
+        for (product, department), summary in zip(jobs, self._complete(prompts, "focus")):
+            results[product][department] = summary
+        self.counts["products"] += len(results)
+        return results
+
+    def run(self, reviews, sorted_by_product=False):
+        """
+        Summarizes the reviews of each product for each department.
+
+        Args:
+            reviews (Iterable[tuple[str, str]]): The product and the text of each review, like `read_reviews` yields.
+            sorted_by_product (bool): (Optional) Whether the reviews of each product are consecutive, so each product
+                is summarized as soon as its reviews end, and only the summaries of the products in the current batch
+                are kept in memory. Defaults to False, the summaries of every product are kept until the end.
+
+        Yields:
+            tuple[str, dict[str, str]]: Each product, and its summary for each department.
+
+        Raises:
+            ValueError: When the reviews are said to be sorted by product, but a product has reviews after the ones of
+                another product.
+        """
+        self._started_at = time.perf_counter()
+        # The products already summarized, only their names are kept
+        finished = set()
+        for batch in _batches(reviews, self.batch_size):
+            if sorted_by_product:
+                reopened = next((product for product, _ in batch if product in finished), None)
+                if reopened is not None:
+                    raise ValueError(f"The reviews of {reopened!r} aren't consecutive, they can't be sorted_by_product")
+            for (product, _), summary in zip(batch, self._map(batch)):
+                self._levels.setdefault(product, [[]])[0].append(summary)
+            self.counts["reviews"] += len(batch)
+            self._reduce_full_levels()
+            if sorted_by_product:
+                last_product = batch[-1][0]
+                done = self._finish([product for product in self._levels if product != last_product])
+                finished.update(done)
+                yield from done.items()
+            if self.progress is not None:
+                self.progress(self.stats())
+        # The products left are finished `batch_size` at a time
+        products = list(self._levels)
+        for start in range(0, len(products), self.batch_size):
+            yield from self._finish(products[start : start + self.batch_size]).items()
+
+
+def print_progress(stats, file=None):
+    """
+    Prints the throughput of a `ReviewSummarizer`, as its `progress` callback.
+
+    Args:
+        stats (dict): The stats of the summarizer.
+        file (TextIO): (Optional) The stream printed to. Defaults to None, the standard output.
+    """
+    requests = stats["map_requests"] + stats["reduce_requests"] + stats["focus_requests"]
+    print(
+        f"{stats['reviews']} reviews, {stats['products']} products done, {stats['open_products']} in progress, "
+        f"{stats['reviews_per_second']:.1f} reviews/s, {requests} requests"
+        + (f", {stats['dedup_hit_rate'] * 100:.1f}% near-duplicates" if "dedup_hit_rate" in stats else ""),
+        file=file,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the reviews of a JSONL or CSV file for each product")
+    parser.add_argument("path", help="JSONL or CSV file of reviews")
+    parser.add_argument("--product-key", default="product", help="column or member identifying the product")
+    parser.add_argument("--text-key", default="review", help="column or member with the review")
+    parser.add_argument(
+        "--sorted",
+        action="store_true",
+        help="the reviews of each product are consecutive, so each product is finished as soon as they end",
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--fan-in", type=int, default=DEFAULT_FAN_IN)
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        help="similarity from which the summary of a previous review is reused, see llm.dedup",
+    )
+    parser.add_argument("--output", help="JSONL file the summaries are written to, instead of the standard output")
+    args = parser.parse_args()
+
+    from llm.dedup import NearDuplicateIndex
+
+    # The progress goes to the standard error, so the standard output only has the summaries
+    summarizer = ReviewSummarizer(
+        batch_size=args.batch_size,
+        fan_in=args.fan_in,
+        progress=lambda stats: print_progress(stats, sys.stderr),
+        dedup=NearDuplicateIndex(args.dedup_threshold) if args.dedup_threshold is not None else None,
+    )
+    reviews = read_reviews(args.path, args.product_key, args.text_key)
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for product, summaries in summarizer.run(reviews, sorted_by_product=args.sorted):
+            output.write(json.dumps({"product": product, **summaries}) + "\n")
+    finally:
+        if args.output:
+            output.close()
+    print_progress(summarizer.stats(), sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import re
+
+from llm.templates import normalize_whitespace
+
+LABELS = ("positive", "negative")
+DEFAULT_THRESHOLD = 0.5
+
+SENTIMENT_INSTRUCTIONS = normalize_whitespace(
+    """
+    What is the sentiment of the following product review, \
+    which is delimited with triple backticks? Give your answer \
+    as a single word, either "positive" or "negative".
+    """
+)
+
+POSITIVE_WORDS = frozenset(
+    """
+    amazing awesome beautiful best better comfortable cute delighted easy excellent fantastic fast favorite fine good
+    gorgeous great happy happily helpful impressed impressive love loved lovely loves nice perfect perfectly pleased
+    quick quickly recommend reliable satisfied smooth soft solid sturdy superb thanks thank wonderful worth
+    works glad enjoy enjoyed affordable cares friendly incredible exceeded fabulous
+    """.split()
+)
+NEGATIVE_WORDS = frozenset(
+    """
+    awful bad broke broken cheap cheaply complaint defective disappointed disappointing disappointment damaged
+    difficult dirty fail failed faulty flimsy hate hated horrible junk late leaking missing poor poorly problem
+    problems refund return returned returning rude slow terrible useless waste worse worst wrong annoying unhappy
+    overpriced gouging lower decreased stopped crack cracked
+    """.split()
+)
+NEGATIONS = frozenset("not no never nothing hardly barely don't doesn't didn't isn't wasn't won't can't cannot".split())
+INTENSIFIERS = frozenset("very really extremely so super totally absolutely highly incredibly".split())
+# The words after a negation whose polarity is flipped
+NEGATION_SCOPE = 3
+
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+class LexiconScorer:
+    """
+    Local sentiment scorer counting the positive and negative words of a text, with the polarity of the words
+    following a negation flipped and the words following an intensifier counted one and a half times.
+
+    Args:
+        positive_words (Collection[str]): (Optional) The positive words. Defaults to `POSITIVE_WORDS`.
+        negative_words (Collection[str]): (Optional) The negative words. Defaults to `NEGATIVE_WORDS`.
+    """
+
+    def __init__(self, positive_words=POSITIVE_WORDS, negative_words=NEGATIVE_WORDS):
+        self.positive_words = frozenset(positive_words)
+        self.negative_words = frozenset(negative_words)
+
+    def score(self, text):
+        """
+        Scores the sentiment of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            tuple[str, float]: The sentiment, "positive" or "negative", and the confidence in it, from 0 when the
+            positive and negative words balance out, or when there are none, to almost 1 when all of many sentiment
+            words agree.
+        """
+        positive = negative = 0.0
+        negated = 0
+        weight = 1.0
+        for word in _WORD_PATTERN.findall(text.lower()):
+            if word in NEGATIONS:
+                negated = NEGATION_SCOPE
+                continue
+            if word in INTENSIFIERS:
+                weight = 1.5
+                continue
+            polarity = 1 if word in self.positive_words else -1 if word in self.negative_words else 0
+            if polarity:
+                if negated:
+                    polarity = -polarity
+                if polarity > 0:
+                    positive += weight
+                else:
+                    negative += weight
+            weight = 1.0
+            negated = max(negated - 1, 0)
+        # Both the margin between the polarities and the amount of evidence raise the confidence
+        confidence = abs(positive - negative) / (positive + negative + 1)
+        return ("positive" if positive >= negative else "negative"), confidence
+
+
+def parse_label(response):
+    """
+    Reads the sentiment answered by the model.
+
+    Args:
+        response (str): The answer, like "Positive." or "The sentiment is negative".
+
+    Returns:
+        str | None: "positive" or "negative", None when the answer has neither or both.
+    """
+    found = [label for label in LABELS if label in response.lower()]
+    return found[0] if len(found) == 1 else None
+
+
+class SentimentCascade:
+    """
+    Sentiment classifier answering locally for the texts the lexicon scorer is confident about, and asking the model
+    for the others only.
+
+    Args:
+        threshold (float): (Optional) The confidence of the scorer under which a text is escalated to the model,
+            0 never escalates and above 1 always does. Defaults to `DEFAULT_THRESHOLD`.
+        scorer (LexiconScorer): (Optional) The local scorer. Defaults to a `LexiconScorer` with the default lexicon.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+        dedup (NearDuplicateIndex): (Optional) The labels of the previous escalated texts, reused for their
+            near-duplicates, see `llm.dedup`. Defaults to None, every escalated text is sent to the model.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, scorer=None, model="gpt-3.5-turbo", dedup=None):
+        self.threshold = threshold
+        self.scorer = scorer or LexiconScorer()
+        self.model = model
+        self.dedup = dedup
+        self.classified = 0
+        self.escalated = 0
+
+    def _ask_model(self, texts):
+        from main import get_completions
+
+        def ask(texts):
+            # Several reviews are classified by each request, see `llm.packing`
+            responses = get_completions(texts, model=self.model, instructions=SENTIMENT_INSTRUCTIONS)
+            return [parse_label(response) for response in responses]
+
+        return ask(texts) if self.dedup is None else self.dedup.dedupe(texts, ask)
+
+    def classify_many(self, texts):
+        """
+        Classifies the sentiment of texts, escalating the uncertain ones to the model in parallel.
+
+        Args:
+            texts (list[str]): The texts.
+
+        Returns:
+            list[dict]: The "label", the "confidence" of the scorer and whether the text was "escalated", for each
+            text. The label of an escalated text is the scorer one when the model answer can't be read.
+        """
+        results = []
+        for text in texts:
+            label, confidence = self.scorer.score(text)
+            results.append({"label": label, "confidence": confidence, "escalated": confidence < self.threshold})
+        escalated = [index for index, result in enumerate(results) if result["escalated"]]
+        if escalated:
+            for index, label in zip(escalated, self._ask_model([texts[index] for index in escalated])):
+                results[index]["label"] = label or results[index]["label"]
+        self.classified += len(texts)
+        self.escalated += len(escalated)
+        return results
+
+    def classify(self, text):
+        """
+        Classifies the sentiment of a text, see `classify_many`.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: "positive" or "negative".
+        """
+        return self.classify_many([text])[0]["label"]
+
+    def stats(self):
+        """
+        Returns the counters of the classifications.
+
+        Returns:
+            dict: The texts classified, the ones escalated to the model, the escalation rate, and the hit rate of the
+            near-duplicate index when there is one.
+        """
+        stats = {
+            "classified": self.classified,
+            "escalated": self.escalated,
+            "escalation_rate": self.escalated / self.classified if self.classified else 0.0,
+        }
+        if self.dedup is not None:
+            stats["dedup_hit_rate"] = self.dedup.stats()["hit_rate"]
+        return stats
+
+    def evaluate(self, texts, labels=None, thresholds=(0.0, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 1.01)):
+        """
+        Measures the trade-off between the cost and the accuracy of the thresholds on a sample, asking the model for
+        the sentiment of every text once.
+
+        Args:
+            texts (list[str]): The sample texts.
+            labels (list[str]): (Optional) The true sentiment of each text. Defaults to None, only the agreement with
+                the model is measured.
+            thresholds (Iterable[float]): (Optional) The thresholds compared. Defaults to 0 to above 1, from never
+                to always escalating.
+
+        Returns:
+            list[dict]: For each threshold, the escalation rate, the agreement of the cascade with the model on every
+            text and on the texts it answers locally, and its accuracy and the model one when labels are given.
+        """
+        scores = [self.scorer.score(text) for text in texts]
+        model_labels = self._ask_model(texts)
+        rows = []
+        for threshold in thresholds:
+            local = [index for index, (_, confidence) in enumerate(scores) if confidence >= threshold]
+            local_set = set(local)
+            cascade = [
+                scores[index][0] if index in local_set else model_labels[index] or scores[index][0]
+                for index in range(len(texts))
+            ]
+            row = {
+                "threshold": threshold,
+                "escalation_rate": 1 - len(local) / len(texts) if texts else 0.0,
+                "agreement": _agreement(cascade, model_labels),
+                "local_agreement": _agreement([cascade[index] for index in local], [model_labels[i] for i in local]),
+            }
+            if labels is not None:
+                row["accuracy"] = _agreement(cascade, labels)
+                row["model_accuracy"] = _agreement(model_labels, labels)
+            rows.append(row)
+        return rows
+
+
+def _agreement(predicted, reference):
+    pairs = [(a, b) for a, b in zip(predicted, reference) if b is not None]
+    return sum(a == b for a, b in pairs) / len(pairs) if pairs else None
+
+
+def print_evaluation(rows):
+    """
+    Prints the rows returned by `SentimentCascade.evaluate` as a table.
+
+    Args:
+        rows (list[dict]): The rows.
+    """
+    columns = [name for name in rows[0] if name != "threshold"] if rows else []
+    print(f"{'threshold':>10}" + "".join(f"{name:>18}" for name in columns))
+    for row in rows:
+        values = ("-" if row[name] is None else f"{row[name] * 100:.1f}%" for name in columns)
+        print(f"{row['threshold']:>10.2f}" + "".join(f"{value:>18}" for value in values))
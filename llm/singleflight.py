@@ -0,0 +1,134 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Shares a single call between the callers asking for the same key at the same time, so identical concurrent
+    requests pay for one upstream call, and every caller gets its result or its error.
+
+    Calls made from threads are shared with the other threads, and calls made from coroutines with the other
+    coroutines of the same event loop.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._acalls = {}
+
+    def do(self, key, function):
+        """
+        Calls a function, unless a call for the same key is in flight, in which case its result is waited for.
+
+        Args:
+            key (Hashable): The key identifying identical calls, like the response cache key of a request.
+            function (Callable[[], Any]): Makes the call.
+
+        Returns:
+            Any: The result of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, function):
+        """
+        Asynchronous counterpart of `do`.
+
+        Args:
+            key (Hashable): The key identifying identical calls, like the response cache key of a request.
+            function (Callable[[], Awaitable]): Makes the call.
+
+        Returns:
+            Any: The result of the call.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._acalls.get(loop_key)
+                leader = future is None
+                if leader:
+                    future = self._acalls[loop_key] = loop.create_future()
+                    self.calls += 1
+                else:
+                    self.shared += 1
+            if leader:
+                break
+            try:
+                # Shielded, so a waiter being cancelled doesn't cancel the call of the others
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller making the call was cancelled, one of the waiters makes it instead
+
+        try:
+            result = await function()
+            future.set_result(result)
+            return result
+        except Exception as error:
+            future.set_exception(error)
+            # Retrieved here, so an error nobody else waited for isn't reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._acalls[loop_key]
+            # The call was cancelled or interrupted, like by a KeyboardInterrupt, so one of the waiters makes it instead
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        """
+        Returns the counters of the shared calls.
+
+        Returns:
+            dict: The calls made, and the calls saved by sharing the result of a call in flight.
+        """
+        with self._lock:
+            return {"calls": self.calls, "saved": self.shared}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """
+    Returns the single-flight group shared by the completion functions.
+
+    Returns:
+        SingleFlight: The single-flight group.
+    """
+    return _single_flight
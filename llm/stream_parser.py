@@ -0,0 +1,356 @@
+import json
+
+# Characters of text, like "Here is the JSON:" or a markdown code fence, accepted before the JSON value
+MAX_PREAMBLE = 200
+
+
+class StreamDivergedError(ValueError):
+    """
+    Raised when a streamed completion stops matching the expected output shape, or ends before it is complete.
+    """
+
+
+def _strip_trailing_commas(text):
+    # Models often leave a comma after the last member of an object or element of an array, like "2.00,}"
+    chars = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "}]":
+            while chars and chars[-1].isspace():
+                chars.pop()
+            if chars and chars[-1] == ",":
+                chars.pop()
+        chars.append(char)
+    return "".join(chars)
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            return json.loads(_strip_trailing_commas(text))
+        except json.JSONDecodeError:
+            raise StreamDivergedError(f"Malformed JSON: {text!r}") from None
+
+
+def _check_type(name, value, expected):
+    if expected is object or value is None:
+        return
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    if float in expected:
+        expected += (int,)
+    if not isinstance(value, expected) or (isinstance(value, bool) and bool not in expected):
+        raise StreamDivergedError(f"{name} should be a {' or '.join(t.__name__ for t in expected)}, got {value!r}")
+
+
+class LineRecordParser:
+    """
+    Incremental parser of "key: value" lines, like the "topic: 0 or 1" answers of the news alerts prompt.
+
+    Each line is validated as soon as it is complete, and the beginning of a line as soon as it can no longer start
+    with one of the expected keys, so a diverging answer is detected in its first characters.
+
+    Args:
+        keys (list[str]): The expected keys, matched case-insensitively.
+        value_type (Callable[[str], Any]): (Optional) Converts the values, raising ValueError for invalid ones.
+            Defaults to str.
+        choices (Collection): (Optional) The allowed converted values. Defaults to any value.
+        separator (str): (Optional) The separator between a key and its value. Defaults to ":".
+    """
+
+    def __init__(self, keys, value_type=str, choices=None, separator=":"):
+        self.keys = {key.lower(): key for key in keys}
+        self.value_type = value_type
+        self.choices = choices
+        self.separator = separator
+        self.record = {}
+        self.consumed = 0
+        self._line = ""
+
+    @property
+    def done(self):
+        """
+        bool: Whether every expected key was found.
+        """
+        return len(self.record) == len(self.keys)
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        key, separator, value = line.partition(self.separator)
+        key = key.strip().lower()
+        if not separator or key not in self.keys:
+            raise StreamDivergedError(f"Unexpected line {line!r}")
+        try:
+            value = self.value_type(value.strip())
+        except ValueError:
+            raise StreamDivergedError(f"Invalid value in line {line!r}") from None
+        if self.choices is not None and value not in self.choices:
+            raise StreamDivergedError(f"Invalid value in line {line!r}")
+        self.record.setdefault(self.keys[key], value)
+
+    def feed(self, delta):
+        """
+        Consumes the next text delta of the completion.
+
+        Args:
+            delta (str): The text delta.
+
+        Returns:
+            bool: Whether the record is complete, so the rest of the completion isn't needed.
+
+        Raises:
+            StreamDivergedError: When the completion doesn't match the expected lines.
+        """
+        self.consumed += len(delta)
+        *lines, self._line = (self._line + delta).split("\n")
+        for line in lines:
+            self._parse_line(line)
+            if self.done:
+                return True
+        key, separator, _ = self._line.lstrip().lower().partition(self.separator)
+        if (key.strip() not in self.keys) if separator else not any(name.startswith(key) for name in self.keys):
+            raise StreamDivergedError(f"Unexpected line {self._line!r}")
+        return False
+
+    def finish(self):
+        """
+        Consumes the end of the completion.
+
+        Raises:
+            StreamDivergedError: When the last line is invalid, or some keys are missing.
+        """
+        line, self._line = self._line, ""
+        self._parse_line(line)
+        if not self.done:
+            missing = [key for key in self.keys.values() if key not in self.record]
+            raise StreamDivergedError(f"The completion ended without {', '.join(missing)}")
+
+    def result(self):
+        """
+        Returns the parsed record.
+
+        Returns:
+            dict: The value of each key found, with the spelling of the expected keys.
+        """
+        return dict(self.record)
+
+
+class JsonParser:
+    """
+    Incremental parser of a completion answering with a JSON object, or an array of JSON objects.
+
+    Every member of the object, or element of the array, is validated against the schema as soon as it is complete.
+    An object can be complete before its closing brace, once all its required members are there. A short preamble
+    before the JSON value, like a sentence introducing it or a markdown code fence, and a trailing comma before a
+    closing brace or bracket are accepted.
+
+    Args:
+        schema (dict[str, type | tuple[type]]): (Optional) The expected type of each member, `object` for any type.
+            Defaults to any members.
+        required (list[str]): (Optional) The members that must be present. Defaults to all the schema members.
+        strict (bool): (Optional) Whether members missing from the schema are invalid. Defaults to False.
+        array (bool): (Optional) Whether the completion is an array of objects instead of a single object.
+            Defaults to False.
+        stop_when_complete (bool): (Optional) Whether an object is complete as soon as its required members are
+            there. Defaults to True.
+    """
+
+    def __init__(self, schema=None, required=None, strict=False, array=False, stop_when_complete=True):
+        self.schema = schema or {}
+        self.required = list(self.schema) if required is None else list(required)
+        self.strict = strict
+        self.array = array
+        self.stop_when_complete = stop_when_complete and not array
+        self.consumed = 0
+        self.done = False
+        self._text = ""
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._checked = 0
+        self._value = None
+
+    def _validate_object(self, value, where="The completion"):
+        if not isinstance(value, dict):
+            raise StreamDivergedError(f"{where} should be a JSON object, got {value!r}")
+        for name, member in value.items():
+            if name in self.schema:
+                _check_type(name, member, self.schema[name])
+            elif self.strict:
+                raise StreamDivergedError(f"Unexpected member {name!r}")
+
+    def _validate_partial(self, end):
+        closing = "]" if self.array else "}"
+        value = _loads(self._text[self._start : end] + closing)
+        items = value if self.array else [value]
+        for item in items[self._checked :]:
+            self._validate_object(item, "Each element" if self.array else "The completion")
+        if self.array:
+            self._checked = len(items)
+        return value
+
+    def _missing(self, value):
+        return [name for name in self.required if name not in value]
+
+    def _find_start(self):
+        opening = "[" if self.array else "{"
+        position = self._text.find(opening, 0, MAX_PREAMBLE + 1)
+        if position == -1:
+            if len(self._text) > MAX_PREAMBLE:
+                raise StreamDivergedError(f"The completion should start with {opening!r}, got {self._text[:40]!r}")
+            return
+        self._start = position
+
+    def feed(self, delta):
+        """
+        Consumes the next text delta of the completion.
+
+        Args:
+            delta (str): The text delta.
+
+        Returns:
+            bool: Whether the JSON value is complete, so the rest of the completion isn't needed.
+
+        Raises:
+            StreamDivergedError: When the completion isn't the expected JSON value.
+        """
+        if self.done:
+            return True
+        self.consumed += len(delta)
+        position = len(self._text)
+        self._text += delta
+        if self._start is None:
+            self._find_start()
+            if self._start is None:
+                return False
+            position = self._start
+
+        for index in range(position, len(self._text)):
+            char = self._text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._complete(index + 1)
+            elif char == "," and self._depth == 1:
+                value = self._validate_partial(index)
+                if self.stop_when_complete and not self._missing(value):
+                    self._value = value
+                    self.done = True
+                    return True
+        return False
+
+    def _complete(self, end):
+        value = _loads(self._text[self._start : end])
+        items = value if self.array else [value]
+        if self.array and not isinstance(value, list):
+            raise StreamDivergedError(f"The completion should be a JSON array, got {value!r}")
+        for item in items:
+            self._validate_object(item, "Each element" if self.array else "The completion")
+            missing = self._missing(item)
+            if missing:
+                raise StreamDivergedError(f"The JSON object has no {', '.join(missing)}")
+        self._value = value
+        self.done = True
+        return True
+
+    def finish(self):
+        """
+        Consumes the end of the completion.
+
+        Raises:
+            StreamDivergedError: When the completion ended before the end of the JSON value.
+        """
+        if not self.done:
+            raise StreamDivergedError("The completion ended before the end of the JSON value")
+
+    def result(self):
+        """
+        Returns the parsed JSON value.
+
+        Returns:
+            dict | list[dict]: The object, or the array of objects.
+        """
+        return self._value
+
+
+def _close(deltas):
+    close = getattr(deltas, "close", None)
+    if close is not None:
+        close()
+
+
+def parse_stream(deltas, parser):
+    """
+    Feeds the text deltas of a streamed completion to an incremental parser, and stops reading the stream as soon as
+    the parser has its result or the completion diverges, which cancels the rest of the generation.
+
+    Args:
+        deltas (Iterator[str]): The text deltas, like the ones returned by `get_completion(..., stream=True)`.
+        parser (LineRecordParser | JsonParser): The parser.
+
+    Returns:
+        Any: The result of the parser.
+
+    Raises:
+        StreamDivergedError: When the completion doesn't match the shape expected by the parser.
+    """
+    try:
+        for delta in deltas:
+            if parser.feed(delta):
+                break
+        else:
+            parser.finish()
+    finally:
+        _close(deltas)
+    return parser.result()
+
+
+async def aparse_stream(deltas, parser):
+    """
+    Asynchronous counterpart of `parse_stream`, for the deltas returned by `aget_completion(..., stream=True)`.
+
+    Args:
+        deltas (AsyncIterator[str]): The text deltas.
+        parser (LineRecordParser | JsonParser): The parser.
+
+    Returns:
+        Any: The result of the parser.
+
+    Raises:
+        StreamDivergedError: When the completion doesn't match the shape expected by the parser.
+    """
+    try:
+        async for delta in deltas:
+            if parser.feed(delta):
+                break
+        else:
+            parser.finish()
+    finally:
+        aclose = getattr(deltas, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return parser.result()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+_time_to_first_token = {"count": 0, "total": 0.0, "max": 0.0, "last": None}
+_time_to_first_token_lock = threading.Lock()
+
+
+def record_time_to_first_token(seconds):
+    """
+    Records the seconds a streamed completion took to produce its first text delta.
+
+    Args:
+        seconds (float): The time to first token.
+    """
+    with _time_to_first_token_lock:
+        _time_to_first_token["count"] += 1
+        _time_to_first_token["total"] += seconds
+        _time_to_first_token["max"] = max(_time_to_first_token["max"], seconds)
+        _time_to_first_token["last"] = seconds
+
+
+def time_to_first_token_stats():
+    """
+    Returns the time to first token of the streamed completions so far.
+
+    Returns:
+        dict: The number of streamed completions and their mean, maximum and last time to first token in seconds.
+    """
+    with _time_to_first_token_lock:
+        count = _time_to_first_token["count"]
+        return {
+            "count": count,
+            "mean": _time_to_first_token["total"] / count if count else None,
+            "max": _time_to_first_token["max"],
+            "last": _time_to_first_token["last"],
+        }
+
+
+def _delta_content(chunk):
+    return chunk.choices[0].delta.get("content") or ""
+
+
+def iter_content(chunks, started_at):
+    """
+    Turns the chunks of a streamed ChatCompletion into the text deltas they carry.
+
+    Args:
+        chunks (Iterable): The chunks returned by `openai.ChatCompletion.create` with `stream=True`.
+        started_at (float): The `time.perf_counter()` when the request was sent.
+
+    Yields:
+        str: The non-empty text deltas, in order.
+    """
+    first = True
+    try:
+        for chunk in chunks:
+            content = _delta_content(chunk)
+            if not content:
+                continue
+            if first:
+                record_time_to_first_token(time.perf_counter() - started_at)
+                first = False
+            yield content
+    finally:
+        # Closing the chunks early releases the response, so a consumer can stop the generation
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+async def aiter_content(chunks, started_at):
+    """
+    Asynchronous counterpart of `iter_content`, for the chunks returned by `openai.ChatCompletion.acreate`.
+
+    Args:
+        chunks (AsyncIterable): The chunks returned by `openai.ChatCompletion.acreate` with `stream=True`.
+        started_at (float): The `time.perf_counter()` when the request was sent.
+
+    Yields:
+        str: The non-empty text deltas, in order.
+    """
+    first = True
+    try:
+        async for chunk in chunks:
+            content = _delta_content(chunk)
+            if not content:
+                continue
+            if first:
+                record_time_to_first_token(time.perf_counter() - started_at)
+                first = False
+            yield content
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
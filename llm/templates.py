@@ -0,0 +1,100 @@
+import re
+import textwrap
+from string import Formatter
+
+from llm.tokens import count_tokens
+
+_SPACES_PATTERN = re.compile(r"[ \t]+")
+_BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+
+
+def normalize_whitespace(text):
+    """
+    Removes the whitespace of a text that only comes from the source code layout: the indentation of triple-quoted
+    strings, the spaces left by backslash line continuations, trailing spaces and runs of blank lines.
+
+    Line breaks and single blank lines are kept, since they separate the parts of a prompt.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    lines = (_SPACES_PATTERN.sub(" ", line).strip() for line in textwrap.dedent(text).split("\n"))
+    return _BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip()
+
+
+class PromptTemplate:
+    """
+    Prompt with named `{placeholders}`, normalized with `normalize_whitespace` and validated once when it is defined,
+    so that rendering it only substitutes the values.
+
+    Args:
+        template (str): The prompt, with `str.format` style named placeholders. Literal braces are written `{{ }}`.
+        normalize (bool): (Optional) Whether to normalize the whitespace of the prompt. Defaults to True.
+
+    Raises:
+        ValueError: When a placeholder is positional, or uses attribute or index access.
+    """
+
+    def __init__(self, template, normalize=True):
+        self.raw = template
+        self.template = normalize_whitespace(template) if normalize else template
+        self._parts = []
+        variables = []
+        for literal, field, format_spec, conversion in Formatter().parse(self.template):
+            if field is not None and not field.isidentifier():
+                raise ValueError(f"Invalid placeholder {{{field}}}, only named placeholders are supported")
+            self._parts.append((literal, field, format_spec, conversion))
+            if field is not None and field not in variables:
+                variables.append(field)
+        self.variables = tuple(variables)
+
+    def render(self, **values):
+        """
+        Substitutes the values of the placeholders.
+
+        Args:
+            **values: The value of each placeholder.
+
+        Returns:
+            str: The prompt.
+
+        Raises:
+            KeyError: When a placeholder has no value.
+        """
+        chunks = []
+        for literal, field, format_spec, conversion in self._parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            elif conversion == "a":
+                value = ascii(value)
+            chunks.append(format(value, format_spec) if format_spec else str(value))
+        return "".join(chunks)
+
+    __call__ = render
+
+    def token_savings(self, model="gpt-3.5-turbo"):
+        """
+        Compares the tokens of the normalized prompt with the ones of the prompt as written in the source code.
+
+        Args:
+            model (str): (Optional) The model whose tokenizer is used. Defaults to "gpt-3.5-turbo".
+
+        Returns:
+            dict: The "raw_tokens" and "tokens" of the prompt without its values, and the tokens "saved" on every
+            request.
+        """
+        raw_tokens = count_tokens(self.raw, model)
+        tokens = count_tokens(self.template, model)
+        return {"raw_tokens": raw_tokens, "tokens": tokens, "saved": raw_tokens - tokens}
+
+    def __repr__(self):
+        return f"PromptTemplate({self.template!r})"
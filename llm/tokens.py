@@ -0,0 +1,191 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# Context window of each model family, the longest matching prefix wins
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# Formatting tokens added by the chat format around each message, and to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+# Smallest completion worth sending a request for
+MIN_COMPLETION_TOKENS = 16
+# Completion length of the requests not setting one, so a runaway completion can't take all the context window
+DEFAULT_MAX_TOKENS = 1024
+# Fraction of the prompt tokens kept free in the context window when they are only approximated, without tiktoken
+APPROXIMATION_MARGIN = 0.1
+# Texts whose token count is memoized, by digest so the texts themselves aren't kept alive
+COUNT_CACHE_SIZE = 16384
+
+# Same pre-tokenization as the cl100k_base encoding of the chat models, with the letter and number classes spelled
+# with the standard `re` module
+_PIECE_PATTERN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+",
+    re.IGNORECASE,
+)
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+class ContextWindowExceededError(ValueError):
+    """
+    Raised before sending a request whose prompt does not leave room for a completion in the model context window.
+    """
+
+
+def context_window(model):
+    """
+    Returns the context window of a model.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        int: The maximum number of prompt plus completion tokens.
+    """
+    prefixes = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not prefixes:
+        return DEFAULT_CONTEXT_WINDOW
+    return CONTEXT_WINDOWS[max(prefixes, key=len)]
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:  # tiktoken is optional, the approximate counter is used without it
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except (KeyError, ValueError, OSError):
+        # Unknown model, or the encoding files can't be downloaded because the machine is offline
+        return None
+
+
+def _approximate_count(text):
+    count = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        word = piece.strip()
+        if not word:
+            count += 1
+        elif not word.isascii():
+            count += len(word)
+        elif word[-1].isalpha():
+            # Common words are a single token, longer ones are split in chunks of about five characters
+            count += 1 if len(word) <= 7 else math.ceil(len(word) / 5)
+        else:
+            count += math.ceil(len(word) / 2)
+    return count
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    Counts the tokens of a text with the model tokenizer when tiktoken is installed, or approximates it offline.
+
+    The counts of the last `COUNT_CACHE_SIZE` texts are memoized, keyed by a digest of the text.
+
+    Args:
+        text (str): The text to count.
+        model (str): (Optional) The model whose tokenizer is used. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        int: The number of tokens.
+    """
+    key = (model, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+    encoding = _encoding(model)
+    count = len(encoding.encode(text)) if encoding is not None else _approximate_count(text)
+    with _counts_lock:
+        _counts[key] = count
+        if len(_counts) > COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return count
+
+
+def count_message_tokens(message, model="gpt-3.5-turbo"):
+    """
+    Counts the prompt tokens of a chat message, memoized so the messages resent on every turn are counted once.
+
+    Args:
+        message (dict): The message, with a "role", a "content" and optionally a "name".
+        model (str): (Optional) The model whose tokenizer is used. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        int: The number of tokens, including the chat formatting ones.
+    """
+    tokens = TOKENS_PER_MESSAGE + count_tokens(message["role"], model) + count_tokens(message["content"], model)
+    if message.get("name") is not None:
+        tokens += TOKENS_PER_NAME + count_tokens(message["name"], model)
+    return tokens
+
+
+def count_messages_tokens(messages, model="gpt-3.5-turbo"):
+    """
+    Counts the prompt tokens of a list of chat messages.
+
+    Args:
+        messages (list[dict]): The messages.
+        model (str): (Optional) The model whose tokenizer is used. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        int: The number of prompt tokens the API bills for the messages.
+    """
+    return sum(count_message_tokens(message, model) for message in messages) + TOKENS_PER_REPLY
+
+
+def default_max_tokens():
+    """
+    Returns the completion length of the requests not setting one.
+
+    Returns:
+        int | None: The `OPENAI_MAX_TOKENS` environment variable or `DEFAULT_MAX_TOKENS`, None when it is 0, all the
+        room left in the context window.
+    """
+    return int(os.getenv("OPENAI_MAX_TOKENS", DEFAULT_MAX_TOKENS)) or None
+
+
+def budget_request(messages, model="gpt-3.5-turbo", max_tokens=None):
+    """
+    Checks that a request fits in the model context window before sending it, and caps its completion length.
+
+    Args:
+        messages (list[dict]): The messages of the request.
+        model (str): (Optional) The model of the request. Defaults to "gpt-3.5-turbo".
+        max_tokens (int): (Optional) The completion length asked by the caller. Defaults to None, see
+            `default_max_tokens`.
+
+    Returns:
+        tuple[int, int]: The prompt tokens, and the `max_tokens` to send, lowered to the room left in the context
+        window.
+
+    Raises:
+        ContextWindowExceededError: When the prompt leaves less than `MIN_COMPLETION_TOKENS` (or `max_tokens` when
+        smaller) for the completion. Without tiktoken, the prompt tokens are approximated, and `APPROXIMATION_MARGIN`
+        of them are kept free in case the approximation is short.
+    """
+    prompt_tokens = count_messages_tokens(messages, model)
+    margin = 0 if _encoding(model) is not None else math.ceil(prompt_tokens * APPROXIMATION_MARGIN)
+    available = context_window(model) - prompt_tokens - margin
+    needed = MIN_COMPLETION_TOKENS if max_tokens is None else min(max_tokens, MIN_COMPLETION_TOKENS)
+    if available < needed:
+        raise ContextWindowExceededError(
+            f"The prompt has {prompt_tokens} tokens, which leaves {available} of the {context_window(model)} tokens "
+            f"of the {model} context window for the completion"
+        )
+    if max_tokens is None:
+        max_tokens = default_max_tokens() or available
+    return prompt_tokens, min(max_tokens, available)
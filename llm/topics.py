@@ -0,0 +1,270 @@
+import logging
+import re
+import threading
+
+from llm.stream_parser import LineRecordParser, StreamDivergedError, parse_stream
+from llm.templates import PromptTemplate
+
+NEWS_ALERT_PROMPT = PromptTemplate(
+    """
+    Determine whether each item in the following list of \
+    topics is a topic in the text below, which
+    is delimited with triple backticks.
+
+    Give your answer as list with 0 or 1 for each topic.\
+
+    List of topics: {topics}
+
+    Text sample: '''{story}'''
+    """
+)
+# Words too common to make a story a candidate for a topic on their own
+STOPWORDS = frozenset(
+    """
+    a an and are as at be by for from has have in is it its of on or that the their this to was were will with
+    new news about over under more most other some such than then these those
+    """.split()
+)
+MIN_KEYWORD_LENGTH = 4
+
+_WORD_PATTERN = re.compile(r"[\w'’]+")
+_FLAG_PATTERN = re.compile(r"\b[01]\b")
+_logger = logging.getLogger(__name__)
+_TERMINAL = None
+
+
+def normalize_word(word):
+    """
+    Reduces the inflections of a word that keep its meaning, so "NASA's" matches "nasa" and "employees" matches
+    "employee".
+
+    Args:
+        word (str): The word.
+
+    Returns:
+        str: The lower-case word, without possessive and plural endings.
+    """
+    word = word.lower()
+    if word.endswith(("'s", "’s")):
+        word = word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def split_words(text):
+    """
+    Splits a text in normalized words, see `normalize_word`.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list[str]: The words.
+    """
+    return [normalize_word(word) for word in _WORD_PATTERN.findall(text)]
+
+
+class TopicIndex:
+    """
+    Multi-pattern matcher of the keywords of many topics, finding every topic with a keyword in a story in a single
+    pass over its words.
+
+    The keywords are stored in a trie of words, so a story is scanned by walking the trie from each of its words, for
+    at most the length of the longest keyword, and adding or removing a topic only touches the branches of its own
+    keywords, without rebuilding the index.
+
+    Args:
+        topics (Iterable[str]): (Optional) The topics. Defaults to none.
+        aliases (dict[str, list[str]]): (Optional) Other names of some topics, like "national aeronautics and space
+            administration" for "nasa". Defaults to none.
+        match_words (bool): (Optional) Whether each significant word of a topic is a keyword too, so "local government"
+            is a candidate for a story about the government. Defaults to True.
+    """
+
+    def __init__(self, topics=(), aliases=None, match_words=True):
+        self.match_words = match_words
+        self.root = {}
+        self.keywords = {}
+        self._lock = threading.Lock()
+        aliases = aliases or {}
+        for topic in topics:
+            self.add(topic, aliases.get(topic, ()))
+
+    @property
+    def topics(self):
+        """
+        list[str]: The indexed topics, in the order they were added.
+        """
+        return list(self.keywords)
+
+    def _keywords(self, topic, aliases):
+        keywords = {tuple(split_words(name)) for name in (topic, *aliases)} - {()}
+        words = split_words(topic)
+        if self.match_words and len(words) > 1:
+            keywords.update((word,) for word in words if len(word) >= MIN_KEYWORD_LENGTH and word not in STOPWORDS)
+        return keywords
+
+    def add(self, topic, aliases=()):
+        """
+        Indexes a topic, or replaces the aliases of an indexed one.
+
+        Args:
+            topic (str): The topic.
+            aliases (Iterable[str]): (Optional) Other names of the topic. Defaults to none.
+        """
+        keywords = self._keywords(topic, aliases)
+        with self._lock:
+            if topic in self.keywords:
+                self._remove(topic)
+            for words in keywords:
+                node = self.root
+                for word in words:
+                    node = node.setdefault(word, {})
+                node.setdefault(_TERMINAL, set()).add(topic)
+            self.keywords[topic] = keywords
+
+    def _remove(self, topic):
+        for words in self.keywords.pop(topic):
+            path = [self.root]
+            for word in words:
+                path.append(path[-1][word])
+            path[-1][_TERMINAL].discard(topic)
+            if not path[-1][_TERMINAL]:
+                del path[-1][_TERMINAL]
+            # The branches left without any keyword are pruned, from the leaf up
+            for depth in range(len(words), 0, -1):
+                if path[depth]:
+                    break
+                del path[depth - 1][words[depth - 1]]
+
+    def remove(self, topic):
+        """
+        Removes a topic from the index.
+
+        Args:
+            topic (str): The topic.
+
+        Raises:
+            KeyError: When the topic isn't indexed.
+        """
+        with self._lock:
+            self._remove(topic)
+
+    def scan(self, text):
+        """
+        Finds the topics with a keyword in a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            dict[str, set[str]]: The keywords found for each candidate topic.
+        """
+        words = split_words(text)
+        found = {}
+        with self._lock:
+            for start in range(len(words)):
+                node = self.root
+                for position in range(start, len(words)):
+                    node = node.get(words[position])
+                    if node is None:
+                        break
+                    for topic in node.get(_TERMINAL, ()):
+                        found.setdefault(topic, set()).add(" ".join(words[start : position + 1]))
+        return found
+
+
+class TopicAlerts:
+    """
+    Detects the watched topics of the stories of a feed, asking the model to confirm only the topics whose keywords
+    are in a story, and skipping the stories without any.
+
+    Args:
+        index (TopicIndex): The watched topics.
+        prompt (PromptTemplate): (Optional) The prompt with the `topics` and the `story`, asking for a "topic: 0 or 1"
+            line for each topic. Defaults to `NEWS_ALERT_PROMPT`.
+        model (str): (Optional) The model to use. Defaults to "gpt-3.5-turbo".
+    """
+
+    def __init__(self, index, prompt=NEWS_ALERT_PROMPT, model="gpt-3.5-turbo"):
+        self.index = index
+        self.prompt = prompt
+        self.model = model
+        self.counts = {"stories": 0, "skipped": 0, "topics": 0, "candidates": 0, "diverged": 0, "unknown": 0}
+
+    def _ask_again(self, story, topics):
+        from main import get_completion
+
+        # The whole answer is read, and each topic is looked for anywhere in its lines, like "1. nasa: 1"
+        answer = get_completion(self.prompt.render(topics=", ".join(topics), story=story), model=self.model)
+        flags = {}
+        for line in answer.lower().splitlines():
+            for topic in topics:
+                position = line.find(topic.lower())
+                if topic in flags or position == -1:
+                    continue
+                flag = _FLAG_PATTERN.search(line, position + len(topic))
+                if flag is not None:
+                    flags[topic] = int(flag.group())
+        return flags
+
+    def detect(self, story):
+        """
+        Tells which watched topics a story is about.
+
+        Args:
+            story (str): The story.
+
+        Returns:
+            dict[str, int | None]: 1 for each topic of the story, 0 for the others, in the order of the index. When the
+            streamed answer diverges from the expected lines, the topics it didn't answer yet are asked again without
+            streaming, and the ones still not answered are None.
+        """
+        from main import get_completion
+
+        topics = self.index.topics
+        found = self.index.scan(story)
+        candidates = [topic for topic in topics if topic in found]
+        self.counts["stories"] += 1
+        self.counts["topics"] += len(topics)
+        self.counts["candidates"] += len(candidates)
+        result = dict.fromkeys(topics, 0)
+        if not candidates:
+            self.counts["skipped"] += 1
+            return result
+
+        # The answer is parsed as it is streamed, and stopped as soon as every candidate is there
+        response = get_completion(
+            self.prompt.render(topics=", ".join(candidates), story=story), model=self.model, stream=True
+        )
+        parser = LineRecordParser(candidates, value_type=int, choices=(0, 1))
+        try:
+            parse_stream(response, parser)
+        except StreamDivergedError as error:
+            self.counts["diverged"] += 1
+            _logger.warning("The news alert answer diverged, asking again for the topics not answered: %s", error)
+        result.update(parser.result())
+        unanswered = [topic for topic in candidates if topic not in parser.result()]
+        if unanswered:
+            flags = self._ask_again(story, unanswered)
+            for topic in unanswered:
+                result[topic] = flags.get(topic)
+            self.counts["unknown"] += len(unanswered) - len(flags)
+        return result
+
+    def stats(self):
+        """
+        Returns the counters of the detections.
+
+        Returns:
+            dict: The stories, the ones that skipped the model, the topics checked, the candidates sent to the model,
+            the answers that diverged from the expected lines, the topics left unknown, and the fractions of stories
+            and topics the prefilter saved.
+        """
+        counts = dict(self.counts)
+        counts["skip_rate"] = counts["skipped"] / counts["stories"] if counts["stories"] else 0.0
+        counts["filtered_rate"] = 1 - counts["candidates"] / counts["topics"] if counts["topics"] else 0.0
+        return counts
@@ -0,0 +1,273 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+_parent = contextvars.ContextVar("llm_span", default=None)
+
+
+class Span:
+    """
+    A timed step of a run, nested in the span active when it started.
+
+    Args:
+        name (str): The name of the step.
+        category (str): The kind of step, like "completion" or "lesson".
+        args (dict): The details shown with the span.
+        parent (Span): The enclosing span, None for a top level one.
+        thread (int): The thread, or asynchronous task, running the step.
+    """
+
+    __slots__ = ("name", "category", "args", "parent", "thread", "start", "end")
+
+    def __init__(self, name, category, args, parent, thread):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.parent = parent
+        self.thread = thread
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        """
+        float: The seconds the step took, None while it runs.
+        """
+        return None if self.end is None else self.end - self.start
+
+    @property
+    def depth(self):
+        """
+        int: The number of enclosing spans.
+        """
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+
+def _current_thread():
+    # Concurrent coroutines run on the same thread, each task is shown as a thread of its own so its spans nest
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is not None and asyncio._get_running_loop() is not None:
+        task = asyncio.current_task()
+        if task is not None:
+            return id(task)
+    return threading.get_ident()
+
+
+class Tracer:
+    """
+    Records nested spans around the completion calls and the named steps of a run, and optionally profiles it with
+    cProfile.
+
+    The spans are exported in the Chrome trace event format, opened with chrome://tracing or https://ui.perfetto.dev,
+    and the profile as a pstats dump, read with `python -m pstats` or snakeviz.
+
+    Args:
+        profile (bool): (Optional) Whether to profile the thread starting the tracer. Defaults to False.
+    """
+
+    def __init__(self, profile=False):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.profiler = None
+        self._lock = threading.Lock()
+        if profile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def span(self, name, category="step", **args):
+        """
+        Records the time spent in the context as a span, nested in the span active when it is entered.
+
+        Args:
+            name (str): The name of the step.
+            category (str): (Optional) The kind of step. Defaults to "step".
+            **args: The details shown with the span.
+
+        Yields:
+            Span: The span, whose `args` can be completed while it runs.
+        """
+        span = Span(name, category, args, _parent.get(), _current_thread())
+        token = _parent.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.args["error"] = type(error).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _parent.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def trace_events(self):
+        """
+        Returns the finished spans as Chrome trace events.
+
+        Returns:
+            list[dict]: The complete ("X") events, with their times in microseconds since the tracer started.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        return [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": span.thread,
+                "args": {
+                    name: value if isinstance(value, (int, float, bool)) else str(value)
+                    for name, value in span.args.items()
+                },
+            }
+            for span in sorted(spans, key=lambda span: span.start)
+        ]
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the finished spans to a Chrome trace event JSON file.
+
+        Args:
+            path (str): The file the trace is written to.
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, file)
+
+    def write_pstats(self, path):
+        """
+        Writes the profile collected so far to a pstats dump.
+
+        Args:
+            path (str): The file the profile is written to.
+
+        Raises:
+            ValueError: When the tracer doesn't profile.
+        """
+        if self.profiler is None:
+            raise ValueError("The tracer was created without profiling")
+        self.profiler.disable()
+        try:
+            self.profiler.dump_stats(path)
+        finally:
+            self.profiler.enable()
+
+    def summary(self):
+        """
+        Returns the time spent in each kind of span.
+
+        Returns:
+            dict: The count and total seconds of the spans of each name.
+        """
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = totals.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] += span.duration
+        return totals
+
+    def stop(self):
+        """
+        Stops profiling.
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+
+
+_tracer = None
+
+
+def get_tracer():
+    """
+    Returns the active tracer.
+
+    Returns:
+        Tracer | None: The tracer, None while tracing is disabled.
+    """
+    return _tracer
+
+
+def enable_tracing(profile=False):
+    """
+    Starts recording the spans of the completion functions and of the lessons.
+
+    Args:
+        profile (bool): (Optional) Whether to profile the calling thread too. Defaults to False.
+
+    Returns:
+        Tracer: The new active tracer.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.stop()
+    _tracer = Tracer(profile=profile)
+    return _tracer
+
+
+def disable_tracing():
+    """
+    Stops recording spans.
+
+    Returns:
+        Tracer | None: The tracer that was active, to export what it recorded.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.stop()
+    return tracer
+
+
+def span(name, category="step", **args):
+    """
+    Records the time spent in the context as a span of the active tracer. Does nothing while tracing is disabled.
+
+    Args:
+        name (str): The name of the step.
+        category (str): (Optional) The kind of step. Defaults to "step".
+        **args: The details shown with the span.
+
+    Returns:
+        ContextManager[Span | None]: The span context.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, category, **args)
+
+
+def traced(name=None, category="step"):
+    """
+    Decorator recording each call of a function as a span, see `span`.
+
+    Args:
+        name (str): (Optional) The name of the spans. Defaults to the qualified name of the function.
+        category (str): (Optional) The kind of step. Defaults to "step".
+    """
+
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,97 @@
+import time
+
+import panel as pn
+
+from llm.metrics import get_metrics
+
+ASSISTANT_STYLE = {"background-color": "#F6F6F6"}
+RENDER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+
+
+class ChatTranscript:
+    """
+    Panel chat transcript that grows by appending the rows of each turn to a single persistent Column, so the cost of
+    rendering a turn doesn't depend on the length of the conversation.
+
+    Past `max_rows` rows, the oldest turns are collapsed into a single line counting them, which keeps the browser
+    document bounded too. The time spent updating the widgets on each turn is recorded in `render_times`, and in the
+    `llm_chat_render_seconds` histogram of the metrics.
+
+    Args:
+        max_rows (int): (Optional) The rows shown before collapsing the oldest turns. Defaults to 40.
+        width (int): (Optional) The width of the messages. Defaults to 600.
+        height (int): (Optional) The height of the scrollable transcript. Defaults to 300.
+    """
+
+    def __init__(self, max_rows=40, width=600, height=300):
+        self.max_rows = max_rows
+        self.width = width
+        self.hidden_turns = 0
+        self.render_times = []
+        self._collapsed = pn.pane.Markdown("", visible=False)
+        self._turn_time = 0.0
+        self.panel = pn.Column(self._collapsed, height=height, scroll=True)
+
+    def add_turn(self, prompt):
+        """
+        Appends the user message and an empty assistant message to the transcript.
+
+        Args:
+            prompt (str): The user message.
+
+        Returns:
+            panel.pane.Markdown: The assistant message pane, to be filled with `update_answer`.
+        """
+        started_at = time.perf_counter()
+        answer = pn.pane.Markdown("", width=self.width, style=ASSISTANT_STYLE)
+        self.panel.extend(
+            [
+                pn.Row("User:", pn.pane.Markdown(prompt, width=self.width)),
+                pn.Row("Assistant:", answer),
+            ]
+        )
+        # The first object is the collapsed turns line, and each turn has two rows
+        if len(self.panel) - 1 > self.max_rows:
+            self.panel.objects = [self._collapsed] + self.panel.objects[3:]
+            self.hidden_turns += 1
+            self._collapsed.object = f"*{self.hidden_turns} earlier turns hidden*"
+            self._collapsed.visible = True
+        self._turn_time = time.perf_counter() - started_at
+        return answer
+
+    def update_answer(self, answer, text):
+        """
+        Replaces the text of an assistant message, as it is streamed.
+
+        Args:
+            answer (panel.pane.Markdown): The pane returned by `add_turn`.
+            text (str): The text received so far.
+        """
+        started_at = time.perf_counter()
+        answer.object = text
+        self._turn_time += time.perf_counter() - started_at
+
+    def finish_turn(self):
+        """
+        Records the widget update time of the current turn.
+        """
+        get_metrics().histogram(
+            "llm_chat_render_seconds", "Widget update time of the chat turns", RENDER_BUCKETS
+        ).observe(self._turn_time)
+        self.render_times.append(self._turn_time)
+        self._turn_time = 0.0
+
+    def render_stats(self):
+        """
+        Returns the widget update time of the turns so far.
+
+        Returns:
+            dict: The number of turns and their mean, maximum and last update time in seconds.
+        """
+        count = len(self.render_times)
+        return {
+            "turns": count,
+            "mean": sum(self.render_times) / count if count else None,
+            "max": max(self.render_times, default=None),
+            "last": self.render_times[-1] if count else None,
+        }
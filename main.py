@@ -1,51 +1,562 @@
-import os
-import sys
-from importlib import import_module
+import time
 
-import openai
-from dotenv import find_dotenv, load_dotenv
+_STARTED_AT = time.perf_counter()
+
+import argparse  # noqa: E402
+import contextvars  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+from importlib import import_module  # noqa: E402
+
+from dotenv import find_dotenv, load_dotenv  # noqa: E402
+
+from llm.cache import get_cache, make_cache_key  # noqa: E402
+from llm.metrics import (  # noqa: E402
+    calling_task,
+    record_cache,
+    record_request,
+    record_retry,
+    start_exporters,
+    task_scope,
+)
+from llm.rate_limit import estimate_tokens, get_rate_limiter  # noqa: E402
+from llm.registry import find_lessons  # noqa: E402
+from llm.resilience import (  # noqa: E402
+    MAX_RETRIES,
+    backoff_delay,
+    get_hedger,
+    is_retryable,
+    request_timeout,
+    total_timeout,
+)
+from llm.singleflight import get_single_flight  # noqa: E402
+from llm.streaming import aiter_content, iter_content  # noqa: E402
+from llm.tokens import budget_request  # noqa: E402
+from llm.tracing import enable_tracing, span  # noqa: E402
 
 _ = load_dotenv(find_dotenv())
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Times a request is queued again after the API answers with a rate limit error before giving up. The other
+# transient errors are retried `llm.resilience.MAX_RETRIES` times, with a jittered exponential backoff
+MAX_RATE_LIMIT_RETRIES = 5
+
+# openai, aiohttp and asyncio take most of the start up time, so they are only imported by the functions that make
+# requests. Listing the lessons or running cached jobs doesn't pay for them.
+_openai = None
+
+
+def _get_openai():
+    global _openai
+    if _openai is None:
+        import openai
+
+        from llm.http import get_session
+
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        get_session()
+        _openai = openai
+    return _openai
+
+
+def _budget(messages, model, params):
+    # Oversized prompts fail here, before paying for a network round trip
+    _, params["max_tokens"] = budget_request(messages, model, params.pop("max_tokens", None))
+    return estimate_tokens(messages, params["max_tokens"], model, params.get("n", 1))
+
+
+def _record_response(model, task, started_at, response):
+    # Streamed responses have no usage, their length is only known once they are consumed
+    usage = response.get("usage") if isinstance(response, dict) else None
+    record_request(
+        model,
+        task,
+        time.perf_counter() - started_at,
+        prompt_tokens=usage["prompt_tokens"] if usage else None,
+        completion_tokens=usage["completion_tokens"] if usage else None,
+    )
+
+
+def _record_error(model, task, started_at, error):
+    record_request(model, task, time.perf_counter() - started_at, outcome=type(error).__name__)
+
+
+def _create_chat_completion(messages, model, temperature, timeout=None, **params):
+    tokens = _budget(messages, model, params)
+    openai = _get_openai()
+    limiter = get_rate_limiter()
+
+    def create(attempt_timeout):
+        return openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,  # this is the degree of randomness of the model's output
+            request_timeout=attempt_timeout,
+            **params,
+        )
+
+    # Deterministic requests are idempotent, so the stragglers can be sent twice. The duplicates count against the
+    # rate limits too, and are skipped when they have no room left
+    if temperature == 0 and not params.get("stream"):
+        hedger = get_hedger()
+
+        def send(attempt_timeout):
+            return hedger.call(lambda: create(attempt_timeout), admit=lambda: limiter.try_acquire(tokens))
+
+    else:
+        send = create
+
+    task = calling_task()
+    rate_limited = failures = 0
+    # Each attempt has its own timeout, and all of them share a deadline
+    deadline = time.monotonic() + total_timeout(timeout)
+    while True:
+        with span("rate limit wait", "completion"):
+            limiter.acquire(tokens)
+        started_at = time.perf_counter()
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise openai.error.Timeout("The request deadline passed before it could be sent again")
+            with span("request", "completion", model=model, attempt=rate_limited + failures):
+                response = send(min(request_timeout(timeout), remaining))
+        except openai.error.RateLimitError as error:
+            _record_error(model, task, started_at, error)
+            if rate_limited == MAX_RATE_LIMIT_RETRIES or time.monotonic() >= deadline:
+                raise
+            rate_limited += 1
+            record_retry(model, task, type(error).__name__)
+            limiter.on_rate_limited(error.headers)
+        except Exception as error:
+            _record_error(model, task, started_at, error)
+            delay = backoff_delay(failures)
+            if failures == MAX_RETRIES or not is_retryable(error) or time.monotonic() + delay >= deadline:
+                raise
+            record_retry(model, task, type(error).__name__)
+            time.sleep(delay)
+            failures += 1
+        else:
+            _record_response(model, task, started_at, response)
+            return response
+
+
+async def _acreate_chat_completion(messages, model, temperature, timeout=None, **params):
+    import asyncio
+
+    tokens = _budget(messages, model, params)
+    openai = _get_openai()
+    limiter = get_rate_limiter()
+
+    def acreate(attempt_timeout):
+        return openai.ChatCompletion.acreate(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            request_timeout=attempt_timeout,
+            **params,
+        )
+
+    if temperature == 0 and not params.get("stream"):
+        hedger = get_hedger()
+
+        def send(attempt_timeout):
+            return hedger.acall(lambda: acreate(attempt_timeout), admit=lambda: limiter.try_acquire(tokens))
+
+    else:
+        send = acreate
+
+    task = calling_task()
+    rate_limited = failures = 0
+    # Each attempt has its own timeout, and all of them share a deadline
+    deadline = time.monotonic() + total_timeout(timeout)
+    while True:
+        with span("rate limit wait", "completion"):
+            await limiter.aacquire(tokens)
+        started_at = time.perf_counter()
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise openai.error.Timeout("The request deadline passed before it could be sent again")
+            with span("request", "completion", model=model, attempt=rate_limited + failures):
+                response = await send(min(request_timeout(timeout), remaining))
+        except openai.error.RateLimitError as error:
+            _record_error(model, task, started_at, error)
+            if rate_limited == MAX_RATE_LIMIT_RETRIES or time.monotonic() >= deadline:
+                raise
+            rate_limited += 1
+            record_retry(model, task, type(error).__name__)
+            limiter.on_rate_limited(error.headers)
+        except Exception as error:
+            _record_error(model, task, started_at, error)
+            delay = backoff_delay(failures)
+            if failures == MAX_RETRIES or not is_retryable(error) or time.monotonic() + delay >= deadline:
+                raise
+            record_retry(model, task, type(error).__name__)
+            await asyncio.sleep(delay)
+            failures += 1
+        else:
+            _record_response(model, task, started_at, response)
+            return response
+
+
+def _completion_params(max_tokens, n, stream):
+    params = {} if max_tokens is None else {"max_tokens": max_tokens}
+    if n != 1:
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        if stream:
+            raise ValueError("Only a single completion can be streamed")
+        params["n"] = n
+    return params
+
+
+def _read_choices(response, n):
+    # The completions of a multi-sample request come back, and are cached, together
+    contents = [choice.message["content"] for choice in response.choices]
+    return contents[0] if n == 1 else contents
+
+
+def _encode_choices(content):
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def _decode_choices(cached, n):
+    return cached if n == 1 else json.loads(cached)
+
+
+def _cache_for(temperature, use_cache):
+    # Only deterministic requests are cached unless the caller asks for it explicitly
+    if use_cache is None:
+        use_cache = temperature == 0
+    return get_cache() if use_cache else None
+
+
+def _stream_completion(messages, model, temperature, cache, timeout=None, **params):
+    key = make_cache_key(model, messages, temperature, **params)
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache(model, calling_task(), cached is not None)
+        if cached is not None:
+            yield cached
+            return
+
+    started_at = time.perf_counter()
+    chunks = _create_chat_completion(messages, model, temperature, timeout=timeout, stream=True, **params)
+    deltas = []
+    for delta in iter_content(chunks, started_at):
+        deltas.append(delta)
+        yield delta
+
+    if cache is not None:
+        cache.set(key, "".join(deltas))
+
+
+async def _astream_completion(messages, model, temperature, cache, timeout=None, **params):
+    key = make_cache_key(model, messages, temperature, **params)
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache(model, calling_task(), cached is not None)
+        if cached is not None:
+            yield cached
+            return
+
+    started_at = time.perf_counter()
+    chunks = await _acreate_chat_completion(messages, model, temperature, timeout=timeout, stream=True, **params)
+    deltas = []
+    async for delta in aiter_content(chunks, started_at):
+        deltas.append(delta)
+        yield delta
+
+    if cache is not None:
+        cache.set(key, "".join(deltas))
+
+
+def get_completion_from_messages(
+    messages, model="gpt-3.5-turbo", temperature=0, use_cache=None, stream=False, max_tokens=None, timeout=None, n=1
+):
+    """
+    Generates a completion based on the given list of messages using OpenAI's ChatCompletion API.
+
+    Args:
+        messages (list[dict]): The conversation messages, each one with a "role" and a "content".
+        model (str): (Optional) The model to use for generating the completion. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+        stream (bool): (Optional) Whether to return the completion as it is generated. Defaults to False.
+        max_tokens (int): (Optional) The maximum length of the completion, lowered to the room left in the model
+            context window. Defaults to None, the `OPENAI_MAX_TOKENS` environment variable or 1024.
+        timeout (float): (Optional) The seconds to wait for each attempt of the request before retrying it, the
+            attempts together being limited by the `OPENAI_TOTAL_TIMEOUT` environment variable or 120. Defaults to
+            None, the `OPENAI_REQUEST_TIMEOUT` environment variable or 60.
+        n (int): (Optional) The completions generated for the same prompt by a single request, only the prompt
+            tokens of one are paid for. It can't be streamed. Defaults to 1.
+
+    Returns:
+        str | list[str] | Iterator[str]: The generated completion as a response to the messages, the list of the `n`
+        completions when `n` is more than 1, or a generator of its text deltas when streaming.
+    """
+    params = _completion_params(max_tokens, n, stream)
+    cache = _cache_for(temperature, use_cache)
+    if stream:
+        return _stream_completion(messages, model, temperature, cache, timeout=timeout, **params)
+
+    key = make_cache_key(model, messages, temperature, **params)
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache(model, calling_task(), cached is not None)
+        if cached is not None:
+            return _decode_choices(cached, n)
+
+    def complete():
+        response = _create_chat_completion(messages, model, temperature, timeout=timeout, **params)
+        content = _read_choices(response, n)
+        if cache is not None:
+            cache.set(key, _encode_choices(content))
+        return content
 
+    with span("get_completion", "completion", model=model):
+        # Identical deterministic requests in flight at the same time share a single call
+        if temperature == 0:
+            return get_single_flight().do(key, complete)
+        return complete()
 
-def get_completion(prompt, model="gpt-3.5-turbo", temperature=0):
+
+def get_completion(
+    prompt, model="gpt-3.5-turbo", temperature=0, use_cache=None, stream=False, max_tokens=None, timeout=None, n=1
+):
     """
     Generates a completion based on the given prompt using OpenAI's ChatCompletion API.
 
     Args:
         prompt (str): The user's input prompt.
         model (str): (Optional) The model to use for generating the completion. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+        stream (bool): (Optional) Whether to return the completion as it is generated. Defaults to False.
+        max_tokens (int): (Optional) The maximum length of the completion, lowered to the room left in the model
+            context window. Defaults to None, the `OPENAI_MAX_TOKENS` environment variable or 1024.
+        timeout (float): (Optional) The seconds to wait for each attempt of the request before retrying it, the
+            attempts together being limited by the `OPENAI_TOTAL_TIMEOUT` environment variable or 120. Defaults to
+            None, the `OPENAI_REQUEST_TIMEOUT` environment variable or 60.
+        n (int): (Optional) The completions generated for the same prompt by a single request, only the prompt
+            tokens of one are paid for. It can't be streamed. Defaults to 1.
 
     Returns:
-        str: The generated completion as a response to the prompt.
+        str | list[str] | Iterator[str]: The generated completion as a response to the prompt, the list of the `n`
+        completions when `n` is more than 1, or a generator of its text deltas when streaming.
     """
     messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
+    return get_completion_from_messages(
+        messages,
         model=model,
-        messages=messages,
-        temperature=temperature,  # this is the degree of randomness of the model's output
+        temperature=temperature,
+        use_cache=use_cache,
+        stream=stream,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        n=n,
     )
-    return response.choices[0].message["content"]
 
 
-def display_menu():
+async def aget_completion_from_messages(
+    messages, model="gpt-3.5-turbo", temperature=0, use_cache=None, stream=False, max_tokens=None, timeout=None, n=1
+):
     """
-    Display a command line menu and execute Python scripts based on user input.
+    Asynchronous counterpart of `get_completion_from_messages`, using OpenAI's ChatCompletion API.
+
+    Args:
+        messages (list[dict]): The conversation messages, each one with a "role" and a "content".
+        model (str): (Optional) The model to use for generating the completion. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+        stream (bool): (Optional) Whether to return the completion as it is generated. Defaults to False.
+        max_tokens (int): (Optional) The maximum length of the completion, lowered to the room left in the model
+            context window. Defaults to None, the `OPENAI_MAX_TOKENS` environment variable or 1024.
+        timeout (float): (Optional) The seconds to wait for each attempt of the request before retrying it, the
+            attempts together being limited by the `OPENAI_TOTAL_TIMEOUT` environment variable or 120. Defaults to
+            None, the `OPENAI_REQUEST_TIMEOUT` environment variable or 60.
+        n (int): (Optional) The completions generated for the same prompt by a single request, only the prompt
+            tokens of one are paid for. It can't be streamed. Defaults to 1.
+
+    Returns:
+        str | list[str] | AsyncIterator[str]: The generated completion as a response to the messages, the list of
+        the `n` completions when `n` is more than 1, or an asynchronous generator of its text deltas when streaming.
     """
-    script_files = sorted(os.listdir("classes"))
-    script_files = [f for f in script_files if f.endswith(".py")]
+    params = _completion_params(max_tokens, n, stream)
+    cache = _cache_for(temperature, use_cache)
+    if stream:
+        return _astream_completion(messages, model, temperature, cache, timeout=timeout, **params)
+
+    key = make_cache_key(model, messages, temperature, **params)
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache(model, calling_task(), cached is not None)
+        if cached is not None:
+            return _decode_choices(cached, n)
+
+    async def complete():
+        response = await _acreate_chat_completion(messages, model, temperature, timeout=timeout, **params)
+        content = _read_choices(response, n)
+        if cache is not None:
+            cache.set(key, _encode_choices(content))
+        return content
+
+    with span("aget_completion", "completion", model=model):
+        if temperature == 0:
+            return await get_single_flight().ado(key, complete)
+        return await complete()
 
-    script_names = [os.path.splitext(f)[0].replace("_", " ").title() for f in script_files]
+
+async def aget_completion(
+    prompt, model="gpt-3.5-turbo", temperature=0, use_cache=None, stream=False, max_tokens=None, timeout=None, n=1
+):
+    """
+    Asynchronous counterpart of `get_completion`, using OpenAI's ChatCompletion API.
+
+    Args:
+        prompt (str): The user's input prompt.
+        model (str): (Optional) The model to use for generating the completion. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+        stream (bool): (Optional) Whether to return the completion as it is generated. Defaults to False.
+        max_tokens (int): (Optional) The maximum length of the completion, lowered to the room left in the model
+            context window. Defaults to None, the `OPENAI_MAX_TOKENS` environment variable or 1024.
+        timeout (float): (Optional) The seconds to wait for each attempt of the request before retrying it, the
+            attempts together being limited by the `OPENAI_TOTAL_TIMEOUT` environment variable or 120. Defaults to
+            None, the `OPENAI_REQUEST_TIMEOUT` environment variable or 60.
+        n (int): (Optional) The completions generated for the same prompt by a single request, only the prompt
+            tokens of one are paid for. It can't be streamed. Defaults to 1.
+
+    Returns:
+        str | list[str] | AsyncIterator[str]: The generated completion as a response to the prompt, the list of the
+        `n` completions when `n` is more than 1, or an asynchronous generator of its text deltas when streaming.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    return await aget_completion_from_messages(
+        messages,
+        model=model,
+        temperature=temperature,
+        use_cache=use_cache,
+        stream=stream,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        n=n,
+    )
+
+
+async def agather_completions(prompts, model="gpt-3.5-turbo", temperature=0, max_concurrency=10, use_cache=None):
+    """
+    Generates the completions of several prompts concurrently, keeping at most `max_concurrency` requests in flight.
+
+    All the requests share a single pooled HTTP session, so its connections are reused between prompts.
+
+    Args:
+        prompts (list[str]): The user's input prompts.
+        model (str): (Optional) The model to use for generating the completions. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        max_concurrency (int): (Optional) The maximum number of requests in flight at once. Defaults to 10.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+
+    Returns:
+        list[str]: The generated completions, in the same order as the prompts.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+
+    import asyncio
+
+    from llm.http import async_session
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded_completion(prompt):
+        async with semaphore:
+            return await aget_completion(prompt, model=model, temperature=temperature, use_cache=use_cache)
+
+    async with async_session(limit=max_concurrency):
+        return await asyncio.gather(*(bounded_completion(prompt) for prompt in prompts))
+
+
+def get_completions(prompts, model="gpt-3.5-turbo", temperature=0, max_workers=16, use_cache=None, instructions=None):
+    """
+    Generates the completions of a batch of prompts from a pool of threads.
+
+    The requests are scheduled by the rate limiter, which keeps them under the account requests and tokens per minute
+    limits and queues them while the budget is exhausted, instead of failing with rate limit errors.
+
+    When `instructions` are given, each prompt is a small item the instructions are applied to, and several items are
+    packed into each request, see `llm.packing.complete_packed`.
+
+    Args:
+        prompts (list[str]): The user's input prompts.
+        model (str): (Optional) The model to use for generating the completions. Defaults to "gpt-3.5-turbo".
+        temperature (float): (Optional) The degree of randomness of the model's output. Defaults to 0.
+        max_workers (int): (Optional) The maximum number of requests in flight at once. Defaults to 16.
+        use_cache (bool): (Optional) Whether to use the response cache. Defaults to None, only when temperature is 0.
+        instructions (str): (Optional) The instructions shared by every prompt. Defaults to None, the prompts are sent
+            as they are.
+
+    Returns:
+        list[str]: The generated completions, in the same order as the prompts.
+    """
+    if instructions is not None:
+        from llm.packing import complete_packed
+
+        return complete_packed(
+            instructions, prompts, model=model, temperature=temperature, max_workers=max_workers, use_cache=use_cache
+        )
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # The worker threads run in a copy of the caller context, so their requests are labelled with the caller task
+    with task_scope(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                get_completion,
+                prompt,
+                model=model,
+                temperature=temperature,
+                use_cache=use_cache,
+            )
+            for prompt in prompts
+        ]
+        return [future.result() for future in futures]
+
+
+def _export_trace(tracer, trace_path, profile_path):
+    if trace_path:
+        tracer.write_chrome_trace(trace_path)
+        print(f"Trace written to {trace_path}")
+    if profile_path:
+        tracer.write_pstats(profile_path)
+        print(f"Profile written to {profile_path}")
+
+
+def display_menu(show_timing=False, trace_path=None, profile_path=None):
+    """
+    Display a command line menu and execute Python scripts based on user input.
+
+    Args:
+        show_timing (bool): (Optional) Whether to print the time it took to start the menu. Defaults to False.
+        trace_path (str): (Optional) The Chrome trace event JSON file the spans of the lessons and of their completion
+            calls are written to after each lesson. Defaults to None, no tracing.
+        profile_path (str): (Optional) The pstats file the cProfile profile of the lessons is written to after each
+            lesson. Defaults to None, no profiling.
+    """
+    lessons = find_lessons()
+    tracer = enable_tracing(profile=bool(profile_path)) if trace_path or profile_path else None
 
     print("")
     print("ChatGPT prompt engineering for developers course!")
     print("Please select a script class to execute:")
     print("")
-    for i, name in enumerate(script_names):
-        print(f"{i+1}) {name}")
+    for i, lesson in enumerate(lessons):
+        print(f"{i+1}) {lesson['name']}")
     print("")
+    if show_timing:
+        print(f"Started in {(time.perf_counter() - _STARTED_AT) * 1000:.1f} ms")
+        print("")
 
     while True:
         try:
@@ -53,13 +564,16 @@ def display_menu():
             if choice == 0:
                 print("Closing the script...")
                 sys.exit()
-            elif choice in range(1, len(script_files) + 1):
-                module_name = os.path.splitext(script_files[choice - 1])[0]
-                module = import_module(f"classes.{module_name}")
-                if hasattr(module, "execute"):
-                    print("")
-                    module.execute()
+            elif choice in range(1, len(lessons) + 1):
+                lesson = lessons[choice - 1]
+                if lesson["has_execute"]:
+                    with span(lesson["name"], "lesson"):
+                        module = import_module(f"classes.{lesson['module']}")
+                        print("")
+                        module.execute()
                     print("")
+                    if tracer is not None:
+                        _export_trace(tracer, trace_path, profile_path)
                 else:
                     print("The selected script does not have an 'execute' function.")
             else:
@@ -69,4 +583,11 @@ def display_menu():
 
 
 if __name__ == "__main__":
-    display_menu()
+    parser = argparse.ArgumentParser(description="ChatGPT prompt engineering for developers course")
+    parser.add_argument("--timing", action="store_true", help="print the time it took to start the menu")
+    parser.add_argument("--trace", metavar="PATH", help="write the spans of the lessons to a Chrome trace JSON file")
+    parser.add_argument("--profile", metavar="PATH", help="write a cProfile profile of the lessons to a pstats file")
+    args = parser.parse_args()
+    # The metrics exporters configured with the LLM_METRICS_PORT and LLM_METRICS_JSON environment variables
+    start_exporters()
+    display_menu(show_timing=args.timing, trace_path=args.trace, profile_path=args.profile)